@@ -5,9 +5,9 @@ Returns: HTTP response with new energy balance
 '''
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared import energy
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
@@ -45,22 +45,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
+    conn.autocommit = True
     cur = conn.cursor()
     
-    safe_amount = str(int(amount)).replace("'", "''")
-    safe_user_id = str(user_id).replace("'", "''")
-    cur.execute(
-        f"UPDATE users SET energy = energy + {safe_amount} WHERE id = '{safe_user_id}' RETURNING energy"
-    )
-    result = cur.fetchone()
+    new_energy = energy.apply(cur, user_id, int(amount), 'add_energy')
     
-    conn.commit()
     cur.close()
     conn.close()
     
@@ -68,5 +58,5 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
         'isBase64Encoded': False,
-        'body': json.dumps({'new_energy': result[0] if result else 0})
+        'body': json.dumps({'new_energy': new_energy or 0})
     }
\ No newline at end of file
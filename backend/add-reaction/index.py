@@ -1,14 +1,15 @@
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared import reactions
+from shared.hot_window import get_window
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Add reaction to message
     Args: event with httpMethod, body (user_id, message_id, emoji)
           context with request_id
-    Returns: HTTP response with operation result
+    Returns: HTTP response with operation result and new count for the emoji
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -46,42 +47,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
+    # Toggle — один атомарный запрос, отдельный COMMIT не нужен
+    conn.autocommit = True
     cur = conn.cursor()
     
-    safe_message_id = str(message_id).replace("'", "''")
-    safe_user_id = str(user_id).replace("'", "''")
-    safe_emoji = emoji.replace("'", "''")
+    action, count, version = reactions.toggle(cur, message_id, user_id, emoji)
     
-    cur.execute(
-        f"SELECT id FROM message_reactions WHERE message_id = '{safe_message_id}' AND user_id = '{safe_user_id}' AND emoji = '{safe_emoji}'"
-    )
-    existing = cur.fetchone()
-    
-    if existing:
-        safe_existing_id = str(existing[0]).replace("'", "''")
-        cur.execute(
-            f"DELETE FROM message_reactions WHERE id = '{safe_existing_id}'"
-        )
-        action = 'removed'
-    else:
-        cur.execute(
-            f"INSERT INTO message_reactions (message_id, user_id, emoji) VALUES ('{safe_message_id}', '{safe_user_id}', '{safe_emoji}')"
-        )
-        action = 'added'
-    
-    conn.commit()
     cur.close()
     conn.close()
     
+    get_window().set_reaction(int(message_id), emoji, count, version)
+    
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'success': True, 'action': action}),
+        'body': json.dumps({'success': True, 'action': action, 'emoji': emoji, 'count': count}),
         'isBase64Encoded': False
     }
\ No newline at end of file
@@ -1,7 +1,9 @@
 import json
 import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared import energy, reactions
+from shared.events import FEED_EVENTS_CHANNEL, notify
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -25,17 +27,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     if method == 'GET':
-        cur.execute("""
-            SELECT id, phone, username, avatar_url, energy, created_at, is_banned
+        cur.execute(f"""
+            SELECT id, phone, username, avatar_url, {energy.balance_sql('users.id', 'users.energy')}, created_at, is_banned
             FROM users
             ORDER BY created_at DESC
         """)
@@ -94,8 +91,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     if action == 'add_energy':
         amount = body_data.get('amount', 0)
-        safe_amount = str(int(amount)).replace("'", "''")
-        cur.execute(f"UPDATE users SET energy = energy + {safe_amount} WHERE id = '{safe_target_id}'")
+        energy.apply(cur, target_user_id, int(amount), 'admin')
         conn.commit()
         result = {'message': f"Added {amount} energy", 'success': True}
         
@@ -111,8 +107,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
     elif action == 'delete':
         cur.execute(f"DELETE FROM messages WHERE user_id = '{safe_target_id}'")
-        cur.execute(f"DELETE FROM message_reactions WHERE user_id = '{safe_target_id}'")
+        # Счётчики и версии реакций на чужих сообщениях уменьшаются в той же транзакции, горячие окна — по событиям
+        reactions.remove_user(cur, target_user_id)
         cur.execute(f"DELETE FROM users WHERE id = '{safe_target_id}'")
+        notify(cur, FEED_EVENTS_CHANNEL, {'type': 'purge', 'userId': int(target_user_id)})
         conn.commit()
         result = {'message': 'User deleted', 'success': True}
         
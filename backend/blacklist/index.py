@@ -5,9 +5,10 @@ Args: event - dict with httpMethod, queryStringParameters, headers
 Returns: HTTP response dict with blocked users list or action result
 """
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.blocklist import get_blocklist
+from shared.db import connect
+from shared.events import BLOCKLIST_CHANNEL, notify
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
@@ -37,12 +38,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     
     try:
         if method == 'GET':
@@ -98,8 +94,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     VALUES ('{safe_user_id}', '{safe_blocked_id}')
                     ON CONFLICT (user_id, blocked_user_id) DO NOTHING
                 ''')
+                changed = cur.rowcount > 0
+                if changed:
+                    notify(cur, BLOCKLIST_CHANNEL, {'userId': int(user_id), 'blockedUserId': int(blocked_user_id)})
                 conn.commit()
             
+            # Кэш своего процесса сбрасываем после COMMIT, остальные получат NOTIFY
+            if changed:
+                get_blocklist().invalidate([user_id, blocked_user_id])
+            
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -127,8 +130,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     DELETE FROM blacklist
                     WHERE user_id = '{safe_user_id}' AND blocked_user_id = '{safe_blocked_id}'
                 ''')
+                changed = cur.rowcount > 0
+                if changed:
+                    notify(cur, BLOCKLIST_CHANNEL, {'userId': int(user_id), 'blockedUserId': int(blocked_user_id)})
                 conn.commit()
             
+            if changed:
+                get_blocklist().invalidate([user_id, blocked_user_id])
+            
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
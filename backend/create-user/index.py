@@ -1,7 +1,6 @@
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -46,12 +45,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     safe_phone = phone.replace("'", "''")
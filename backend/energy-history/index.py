@@ -0,0 +1,92 @@
+import json
+from typing import Dict, Any
+from shared.db import connect
+from shared import energy
+
+MAX_LIMIT = 100
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: История операций с энергией пользователя и текущий баланс
+    Args: event with httpMethod, queryStringParameters (limit, before — seq последней полученной операции),
+          headers (X-User-Id)
+          context with request_id
+    Returns: HTTP response with balance, transactions (от новых к старым) и next_before для следующей страницы
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 204,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    headers = event.get('headers') or {}
+    user_id_str = headers.get('X-User-Id') or headers.get('x-user-id')
+    
+    if not user_id_str:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+    
+    params = event.get('queryStringParameters') or {}
+    try:
+        user_id = int(user_id_str)
+        limit = min(max(int(params.get('limit', 50)), 1), MAX_LIMIT)
+        before_seq = int(params['before']) if params.get('before') else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid limit or before'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = connect()
+    cur = conn.cursor()
+    
+    cur.execute(f"SELECT {energy.balance_sql('users.id', 'users.energy')} FROM users WHERE id = {user_id}")
+    row = cur.fetchone()
+    if not row:
+        cur.close()
+        conn.close()
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'User not found'}),
+            'isBase64Encoded': False
+        }
+    
+    transactions = energy.history(cur, user_id, limit, before_seq)
+    
+    cur.close()
+    conn.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps({
+            'balance': row[0],
+            'transactions': transactions,
+            'next_before': transactions[-1]['seq'] if len(transactions) == limit else None
+        })
+    }
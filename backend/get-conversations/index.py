@@ -5,10 +5,9 @@ Returns: HTTP response with conversations list
 '''
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
-from datetime import datetime, timedelta
+from shared.db import connect, get_dsn
+from shared.presence import get_presence
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
@@ -46,7 +45,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     user_id = int(user_id_str)
-    dsn = os.environ.get('TIMEWEB_DB_URL')
+    dsn = get_dsn()
     
     if not dsn or not dsn.startswith('postgresql://'):
         return {
@@ -56,60 +55,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'TIMEWEB_DB_URL не установлен или неправильный формат'})
         }
     
-    # Добавляем sslmode=require для Timeweb Cloud
-    if '?' in dsn:
-        dsn += '&sslmode=require'
-    else:
-        dsn += '?sslmode=require'
-    
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     safe_user_id = str(user_id).replace("'", "''")
+    # Строки conversations ведёт private-messages: список — диапазон индекса (user_id, last_message_at)
     cur.execute(f"""
-        WITH last_messages AS (
-            SELECT 
-                CASE WHEN sender_id = '{safe_user_id}' THEN receiver_id ELSE sender_id END as other_user_id,
-                text as last_message,
-                created_at,
-                ROW_NUMBER() OVER (PARTITION BY 
-                    CASE WHEN sender_id = '{safe_user_id}' THEN receiver_id ELSE sender_id END 
-                    ORDER BY created_at DESC) as rn
-            FROM private_messages
-            WHERE sender_id = '{safe_user_id}' OR receiver_id = '{safe_user_id}'
-        ),
-        unread_counts AS (
-            SELECT receiver_id, sender_id, COUNT(*) as unread_count
-            FROM private_messages
-            WHERE receiver_id = '{safe_user_id}' AND is_read = FALSE
-            GROUP BY receiver_id, sender_id
-        )
         SELECT 
-            u.id, u.username, u.avatar_url, u.last_activity,
-            lm.last_message, lm.created_at,
-            COALESCE(uc.unread_count, 0) as unread_count
-        FROM last_messages lm
-        JOIN users u ON u.id = lm.other_user_id
-        LEFT JOIN unread_counts uc ON uc.sender_id = u.id
-        WHERE lm.rn = 1
-        ORDER BY lm.created_at DESC
+            u.id, u.username, COALESCE(u.main_photo_url, u.avatar_url), u.last_activity,
+            c.last_message, c.last_message_at, c.unread_count
+        FROM conversations c
+        JOIN users u ON u.id = c.other_user_id
+        WHERE c.user_id = '{safe_user_id}'
+        ORDER BY c.last_message_at DESC
     """)
     
     rows = cur.fetchall()
     
+    # Онлайн-статусы всех собеседников одним обращением к реестру присутствия
+    statuses = get_presence().statuses({row[0]: row[3] for row in rows})
+    
     conversations = []
     for row in rows:
-        last_activity = row[3]
-        is_online = False
-        if last_activity:
-            time_diff = datetime.utcnow() - last_activity
-            is_online = time_diff < timedelta(minutes=5)
-        
         conversations.append({
             'userId': row[0],
             'username': row[1],
             'avatarUrl': row[2],
-            'status': 'online' if is_online else 'offline',
+            'status': statuses[row[0]],
             'lastMessage': row[4],
             'lastMessageAt': row[5].isoformat(),
             'unreadCount': row[6]
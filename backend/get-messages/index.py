@@ -1,30 +1,202 @@
+import base64
 import json
-import os
-import psycopg2
-from typing import Dict, Any
-from math import radians, cos, sin, asin, sqrt
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from shared.db import connect
+from shared.avatars import fallback_avatar
+from shared.blocklist import exclude_sql, get_blocklist, not_related_sql
+from shared.geo import radius_sql_from
+from shared.hot_window import UNKNOWN, get_window
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Расчет расстояния между двумя точками в км (формула гаверсинуса)"""
-    if not all([lat1, lon1, lat2, lon2]):
-        return float('inf')
-    
-    lat1, lon1, lat2, lon2 = map(float, [lat1, lon1, lat2, lon2])
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    km = 6371 * c
-    return km
+# Сколько сообщений на экране клиента проверяется на изменения реакций за один поллинг
+MAX_VISIBLE_IDS = 200
+# Запас на транзакции add-reaction, которые начались до предыдущего поллинга, а закоммитились после
+REACTIONS_SINCE_OVERLAP = "interval '5 seconds'"
+# id сообщениям выдаются до COMMIT: сообщение с меньшим id может закоммититься после поллинга,
+# который уже вернул большее. Поэтому дельта повторяет сообщения до since_id, созданные не раньше чем
+# за MESSAGES_SINCE_OVERLAP до него (не больше MAX_OVERLAP_MESSAGES), а клиент отбрасывает уже показанные по id
+MESSAGES_SINCE_OVERLAP = "interval '5 seconds'"
+MAX_OVERLAP_MESSAGES = 200
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    """Непрозрачный курсор для keyset-пагинации по (created_at, id)"""
+    raw = f'{created_at.isoformat()}|{message_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    """Возвращает (created_at в ISO, id) или None, если курсор битый"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at_str, message_id_str = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at_str).isoformat(), int(message_id_str)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+# Реакции сообщения сразу JSON-массивом из message_reaction_counts (чтение по первичному ключу)
+REACTIONS_JSON_SQL = """COALESCE((
+            SELECT json_agg(json_build_object('emoji', c.emoji, 'count', c.count) ORDER BY c.emoji)
+            FROM message_reaction_counts c
+            WHERE c.message_id = {message_id} AND c.count > 0
+        ), '[]'::json)"""
+
+def page_sql(conditions: list, order: str, limit: str, page_clause: str) -> str:
+    """Страница сообщений с автором; keyset по индексу (created_at, id)"""
+    where_clause = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return f"""
+        SELECT m.id, m.text, m.created_at, u.id AS user_id, u.username, u.main_photo_url
+        FROM messages m
+        JOIN users u ON m.user_id = u.id
+        {where_clause}
+        ORDER BY m.created_at {order}, m.id {order}
+        LIMIT {limit} {page_clause}
+    """
+
+def feed_page_sql(conditions: list, order: str, limit: str, page_clause: str,
+                  user_id: Optional[int], max_distance_km: float) -> str:
+    """
+    page_sql с фильтром по расстоянию от user_id (None — без фильтра). Координаты пользователя берутся
+    подзапросом в том же запросе, без отдельного похода в БД; если их нет, фильтра тоже нет
+    """
+    if user_id is None:
+        return page_sql(conditions, order, limit, page_clause)
+    user_lat = f"(SELECT latitude::float8 FROM users WHERE id = {user_id})"
+    user_lon = f"(SELECT longitude::float8 FROM users WHERE id = {user_id})"
+    has_location = f"COALESCE({user_lat}, 0) <> 0 AND COALESCE({user_lon}, 0) <> 0"
+    # Ветки взаимоисключающие; условие на координаты Postgres вычисляет один раз (InitPlan)
+    # и выполняет только нужную ветку, а ветка с радиусом идёт по индексу users(latitude, longitude)
+    radius_conditions = conditions + [
+        has_location,
+        radius_sql_from('u.latitude', 'u.longitude', user_lat, user_lon, max_distance_km)
+    ]
+    return f"""({page_sql(radius_conditions, order, limit, page_clause)})
+        UNION ALL
+        ({page_sql(conditions + [f"NOT ({has_location})"], order, limit, page_clause)})"""
+
+def build_messages(rows) -> list:
+    """Строки (id, text, created_at, user_id, username, main_photo_url, reactions) -> сообщения для клиента"""
+    messages = []
+    for row in rows:
+        msg_id, text, created_at, user_id, username, main_photo_url, reactions = row
+        user_avatar = main_photo_url or fallback_avatar(username)
+        
+        messages.append({
+            'id': msg_id,
+            'text': text,
+            'created_at': created_at.isoformat() + 'Z',
+            'user': {
+                'id': user_id,
+                'username': username,
+                'avatar': user_avatar
+            },
+            'reactions': reactions
+        })
+    return messages
+
+def delta_response(cur, conn, page: str, since_id: int, visible_ids: list, reactions_since: Optional[str]) -> Dict[str, Any]:
+    """
+    Ответ для поллинга: новые сообщения после since_id плюс повтор недавних до него (клиент убирает дубли по id)
+    и актуальные счётчики реакций только для тех сообщений на экране, реакции которых менялись после reactions_since
+    """
+    changed_reactions_sql = "'{}'::json"
+    if visible_ids:
+        safe_visible_ids = ','.join(str(mid) for mid in visible_ids)
+        changed_filter = ''
+        if reactions_since:
+            changed_filter = f"AND m.reactions_updated_at >= '{reactions_since}'::timestamp - {REACTIONS_SINCE_OVERLAP}"
+        changed_reactions_sql = f"""COALESCE((
+            SELECT json_object_agg(m.id, {REACTIONS_JSON_SQL.format(message_id='m.id')})
+            FROM messages m
+            WHERE m.id IN ({safe_visible_ids}) {changed_filter}
+        ), '{{}}'::json)"""
+    
+    # Одна строка sync присоединяется к каждой строке страницы, чтобы пришла и при пустой странице
+    cur.execute(f"""
+        WITH page AS ({page}),
+        sync AS (
+            SELECT LOCALTIMESTAMP AS sync_at, {changed_reactions_sql} AS changed_reactions
+        )
+        SELECT s.sync_at, s.changed_reactions,
+               p.id, p.text, p.created_at, p.user_id, p.username, p.main_photo_url,
+               {REACTIONS_JSON_SQL.format(message_id='p.id')}
+        FROM sync s
+        LEFT JOIN page p ON true
+        ORDER BY p.created_at ASC, p.id ASC
+    """)
+    rows = cur.fetchall()
+    sync_at, changed_reactions = rows[0][0], rows[0][1]
+    messages = build_messages(row[2:] for row in rows if row[2] is not None)
+    
+    cur.close()
+    conn.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps({
+            'messages': messages,
+            'reactions': changed_reactions,
+            'sync': {
+                # Строки упорядочены по (created_at, id), поэтому последняя не обязательно с наибольшим id
+                'since_id': max([since_id] + [m['id'] for m in messages]),
+                'reactions_since': sync_at.isoformat()
+            }
+        })
+    }
+
+def hot_window_response(user_id_str: Optional[str], limit: int, show_all: bool, max_distance_km: float) -> Optional[Dict[str, Any]]:
+    """Первая страница из горячего окна процесса; None — окно не может ответить, нужен запрос в БД"""
+    window = get_window()
+    if not window.ready:
+        return None
+    
+    origin = None
+    blocked = frozenset()
+    if user_id_str:
+        user_id_int = int(user_id_str)
+        location = window.location(user_id_int) if not show_all else (None, None)
+        cached_blocked = get_blocklist().peek(user_id_int)
+        if location is UNKNOWN or cached_blocked is None:
+            # Первый запрос читателя в этом процессе; дальше координаты обновляет update-location,
+            # а блокировки — blacklist через NOTIFY
+            conn = connect()
+            cur = conn.cursor()
+            if location is UNKNOWN:
+                cur.execute(f"SELECT latitude, longitude FROM users WHERE id = {user_id_int}")
+                location = cur.fetchone() or (None, None)
+                window.set_location(user_id_int, *location)
+            if cached_blocked is None:
+                cached_blocked = get_blocklist().related(cur, user_id_int)
+            cur.close()
+            conn.close()
+        blocked = cached_blocked
+        if location[0] and location[1]:
+            origin = (float(location[0]), float(location[1]))
+    
+    page = window.first_page(limit, origin, max_distance_km, exclude=blocked)
+    if page is None:
+        return None
+    
+    cursors = {'before': None, 'after': None}
+    if page:
+        cursors = {
+            'before': encode_cursor(page[0][0], page[0][1]['id']),
+            'after': encode_cursor(page[-1][0], page[-1][1]['id'])
+        }
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps({'messages': [message for _, message in page], 'cursors': cursors})
+    }
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Get nearby chat messages with user info and reactions based on geolocation
-    Args: event with httpMethod, queryStringParameters (limit, offset), headers (X-User-Id)
+    Args: event with httpMethod, queryStringParameters (limit, before/after cursor or legacy offset, radius;
+          since_id, visible_ids, reactions_since for incremental polling), headers (X-User-Id)
           context with request_id
-    Returns: HTTP response with messages array filtered by distance
+    Returns: HTTP response with messages array filtered by distance, without authors blocked in either direction
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -52,119 +224,129 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     params = event.get('queryStringParameters') or {}
     limit = int(params.get('limit', 20))
     offset = int(params.get('offset', 0))
+    before_cursor = params.get('before')
+    after_cursor = params.get('after')
+    
+    # Режим дельты для поллинга: только сообщения новее since_id и реакции, изменившиеся на экране клиента
+    since_id = params.get('since_id')
+    visible_ids = params.get('visible_ids', '')
+    reactions_since = params.get('reactions_since')
+    try:
+        since_id = int(since_id) if since_id is not None else None
+        visible_ids = [int(mid) for mid in visible_ids.split(',') if mid.strip()][:MAX_VISIBLE_IDS]
+        reactions_since = datetime.fromisoformat(reactions_since).isoformat() if reactions_since else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid since_id, visible_ids or reactions_since'}),
+            'isBase64Encoded': False
+        }
     max_distance_km = float(params.get('radius', 100))  # Радиус по умолчанию 100км
     
     # Если радиус >= 99999, показываем все сообщения
     show_all = max_distance_km >= 99999
     
+    # Курсор before — сообщения старше, after — новее; offset оставлен для старых клиентов
+    cursor_key = None
+    if before_cursor or after_cursor:
+        cursor_key = decode_cursor(before_cursor or after_cursor)
+        if not cursor_key:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Invalid cursor'}),
+                'isBase64Encoded': False
+            }
+    
     headers = event.get('headers', {})
     user_id_str = headers.get('X-User-Id') or headers.get('x-user-id')
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
+    # Верх ленты, который обновляют все клиенты, отдаётся из памяти; в БД идёт только холодная пагинация
+    if since_id is None and not cursor_key and offset == 0:
+        response = hot_window_response(user_id_str, limit, show_all, max_distance_km)
+        if response:
+            return response
+    
+    # Keyset по индексу (created_at, id): стоимость страницы не зависит от глубины прокрутки
+    conditions = []
+    order = 'DESC'
+    page_clause = f"OFFSET {int(offset)}"
+    if since_id is not None:
+        order = 'ASC'
+        page_clause = ''
+    elif cursor_key:
+        cursor_created_at, cursor_id = cursor_key
+        if after_cursor and not before_cursor:
+            conditions.append(f"(m.created_at, m.id) > ('{cursor_created_at}'::timestamp, {cursor_id})")
+            order = 'ASC'
+        else:
+            conditions.append(f"(m.created_at, m.id) < ('{cursor_created_at}'::timestamp, {cursor_id})")
+        page_clause = ''
+    
+    safe_limit = str(limit).replace("'", "''")
     
-    # Получаем координаты текущего пользователя
-    current_user_lat = None
-    current_user_lon = None
+    conn = connect()
+    cur = conn.cursor()
     
+    # Авторы, с которыми у читателя блокировка в любую сторону, отсекаются в WHERE до LIMIT.
+    # Множество берётся из кэша процесса (shared.blocklist), при промахе — anti-join по blacklist в том же запросе
     if user_id_str:
-        user_id_int = int(user_id_str)
-        cur.execute(f"""
-            SELECT latitude, longitude FROM users WHERE id = {user_id_int}
-        """)
-        user_location = cur.fetchone()
-        if user_location:
-            current_user_lat, current_user_lon = user_location
+        cached_blocked = get_blocklist().peek(int(user_id_str))
+        if cached_blocked is None:
+            conditions.append(not_related_sql('m.user_id', str(int(user_id_str))))
+        else:
+            exclusion = exclude_sql('m.user_id', cached_blocked)
+            if exclusion:
+                conditions.append(exclusion)
     
-    safe_limit = str(limit).replace("'", "''")
-    safe_offset = str(offset).replace("'", "''")
+    # Фильтр по расстоянию считается в БД, чтобы страница содержала ровно limit сообщений из радиуса
+    radius_user_id = int(user_id_str) if user_id_str and not show_all else None
+    if since_id is not None:
+        # Повтор не занимает limit: иначе при частых сообщениях дельта не продвигалась бы дальше окна повтора
+        overlap_conditions = conditions + [
+            f"m.id <= {since_id}",
+            f"m.created_at >= (SELECT created_at FROM messages WHERE id = {since_id}) - {MESSAGES_SINCE_OVERLAP}",
+        ]
+        page = f"""({feed_page_sql(conditions + [f"m.id > {since_id}"], order, safe_limit, page_clause, radius_user_id, max_distance_km)})
+        UNION ALL
+        ({feed_page_sql(overlap_conditions, 'DESC', str(MAX_OVERLAP_MESSAGES), page_clause, radius_user_id, max_distance_km)})"""
+    else:
+        page = feed_page_sql(conditions, order, safe_limit, page_clause, radius_user_id, max_distance_km)
+    
+    if since_id is not None:
+        return delta_response(cur, conn, page, since_id, visible_ids, reactions_since)
+    
+    # Страница, авторы и реакции — один запрос; клиенту сообщения отдаются от старых к новым
     cur.execute(f"""
-        SELECT 
-            m.id, m.text, m.created_at,
-            u.id, u.username, u.latitude, u.longitude
-        FROM messages m
-        JOIN users u ON m.user_id = u.id
-        ORDER BY m.created_at DESC
-        LIMIT {safe_limit} OFFSET {safe_offset}
+        WITH page AS ({page})
+        SELECT p.id, p.text, p.created_at, p.user_id, p.username, p.main_photo_url,
+               {REACTIONS_JSON_SQL.format(message_id='p.id')}
+        FROM page p
+        ORDER BY p.created_at ASC, p.id ASC
     """)
     
     rows = cur.fetchall()
+    cur.close()
+    conn.close()
     
     if not rows:
-        cur.close()
-        conn.close()
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'messages': []})
+            'body': json.dumps({'messages': [], 'cursors': {'before': None, 'after': after_cursor}})
         }
     
-    message_ids = [row[0] for row in rows]
-    user_ids = list(set([row[3] for row in rows]))
-    
-    safe_message_ids = ','.join(str(int(mid)) for mid in message_ids)
-    cur.execute(f"""
-        SELECT message_id, emoji, COUNT(*) as count
-        FROM message_reactions
-        WHERE message_id IN ({safe_message_ids})
-        GROUP BY message_id, emoji
-    """)
-    
-    reactions_map = {}
-    for r in cur.fetchall():
-        msg_id = r[0]
-        if msg_id not in reactions_map:
-            reactions_map[msg_id] = []
-        reactions_map[msg_id].append({'emoji': r[1], 'count': r[2]})
-    
-    safe_user_ids = ','.join(str(int(uid)) for uid in user_ids)
-    cur.execute(f"""
-        SELECT DISTINCT ON (user_id) user_id, photo_url
-        FROM user_photos
-        WHERE user_id IN ({safe_user_ids})
-        ORDER BY user_id, display_order ASC, created_at DESC
-    """)
-    
-    avatars_map = {row[0]: row[1] for row in cur.fetchall()}
-    
-    messages = []
-    for row in rows:
-        msg_id, text, created_at, user_id, username, msg_lat, msg_lon = row
-        user_avatar = avatars_map.get(user_id, f'https://api.dicebear.com/7.x/avataaars/svg?seed={username}')
-        
-        # Фильтруем по расстоянию, если у пользователя установлены координаты
-        # Если show_all=True, пропускаем фильтрацию
-        if not show_all and current_user_lat and current_user_lon:
-            distance = calculate_distance(current_user_lat, current_user_lon, msg_lat, msg_lon)
-            if distance > max_distance_km:
-                continue  # Пропускаем слишком далёкие сообщения
-        
-        messages.append({
-            'id': msg_id,
-            'text': text,
-            'created_at': created_at.isoformat() + 'Z',
-            'user': {
-                'id': user_id,
-                'username': username,
-                'avatar': user_avatar
-            },
-            'reactions': reactions_map.get(msg_id, [])
-        })
-    
-    messages.reverse()
-    
-    cur.close()
-    conn.close()
+    messages = build_messages(rows)
+    cursors = {
+        'before': encode_cursor(rows[0][2], rows[0][0]),
+        'after': encode_cursor(rows[-1][2], rows[-1][0])
+    }
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
         'isBase64Encoded': False,
-        'body': json.dumps({'messages': messages})
+        'body': json.dumps({'messages': messages, 'cursors': cursors})
     }
\ No newline at end of file
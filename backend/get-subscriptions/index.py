@@ -5,8 +5,8 @@ Returns: HTTP response with array of subscribed user IDs
 '''
 
 import json
-import os
 from typing import Dict, Any
+from shared.db import connect
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
@@ -38,13 +38,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     user_id = int(user_id_str)
     
-    import psycopg2
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     try:
@@ -1,7 +1,8 @@
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared.energy import balance_sql
+from shared.presence import get_presence
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -47,14 +48,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    print(f'[DEBUG GET-USER] DSN value: {dsn[:60] if dsn else "None/Empty"}')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    print(f'[DEBUG GET-USER] Final DSN: {dsn[:60] if dsn else "None/Empty"}')
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     # Use simple query protocol - user_id is already validated as integer
@@ -72,7 +66,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     # Try with city column first, fallback if it doesn't exist
     try:
         cur.execute(
-            f"SELECT id, phone, username, avatar_url, energy, is_banned, bio, last_activity, latitude, longitude, city FROM users WHERE id = {user_id_int}"
+            f"SELECT id, phone, username, avatar_url, {balance_sql('users.id', 'users.energy')}, is_banned, bio, last_activity, latitude, longitude, city FROM users WHERE id = {user_id_int}"
         )
         row = cur.fetchone()
         has_city = True
@@ -87,10 +81,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         except:
             pass
         # Reconnect
-        conn = psycopg2.connect(dsn)
+        conn = connect()
         cur = conn.cursor()
         cur.execute(
-            f"SELECT id, phone, username, avatar_url, energy, is_banned, bio, last_activity, latitude, longitude FROM users WHERE id = {user_id_int}"
+            f"SELECT id, phone, username, avatar_url, {balance_sql('users.id', 'users.energy')}, is_banned, bio, last_activity, latitude, longitude FROM users WHERE id = {user_id_int}"
         )
         row = cur.fetchone()
         has_city = False
@@ -105,13 +99,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    # Проверяем активность (онлайн если был активен менее 5 минут назад)
-    from datetime import datetime, timedelta
-    last_activity = row[7]
-    is_online = False
-    if last_activity:
-        time_diff = datetime.utcnow() - last_activity
-        is_online = time_diff < timedelta(minutes=5)
+    # Онлайн, если был активен в пределах PRESENCE_TTL_SECONDS (реестр присутствия или last_activity)
+    status = get_presence().status(row[0], row[7])
     
     result_data = {
         'id': row[0],
@@ -122,7 +111,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'is_admin': False,
         'is_banned': row[5] if row[5] is not None else False,
         'bio': row[6] if row[6] else '',
-        'status': 'online' if is_online else 'offline',
+        'status': status,
         'latitude': float(row[8]) if len(row) > 8 and row[8] is not None else None,
         'longitude': float(row[9]) if len(row) > 9 and row[9] is not None else None,
         'city': row[10] if has_city and len(row) > 10 and row[10] else ''
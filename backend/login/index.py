@@ -1,8 +1,8 @@
 import json
-import os
-import psycopg2
 import hashlib
 from typing import Dict, Any
+from shared.db import connect
+from shared.energy import balance_sql
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -47,19 +47,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    print(f'[DEBUG] Original DSN: {dsn[:50] if dsn else "None"}')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    print(f'[DEBUG] Modified DSN: {dsn[:50] if dsn else "None"}')
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     safe_phone = phone.replace("'", "''")
     cur.execute(
-        f"SELECT id, username, avatar_url, password_hash, is_banned, is_admin, energy FROM users WHERE phone = '{safe_phone}'"
+        f"SELECT id, username, avatar_url, password_hash, is_banned, is_admin, {balance_sql('users.id', 'users.energy')} FROM users WHERE phone = '{safe_phone}'"
     )
     result = cur.fetchone()
     
@@ -0,0 +1,143 @@
+import json
+from typing import Dict, Any, List, Optional, Tuple
+from shared.db import connect
+from shared.avatars import fallback_avatar
+from shared.geo import distance_sql, radius_sql
+from shared.nearby import MAX_DISTANCE_KM, get_grid
+from shared.presence import get_presence
+
+MAX_LIMIT = 100
+# Радиусы поиска k ближайших через БД, пока сетка процесса не загружена
+FALLBACK_RADII_KM = [50, 200, 1000, 5000, MAX_DISTANCE_KM]
+
+def nearest_from_db(cur, lat: float, lon: float, limit: int, radius_km: Optional[float], exclude: int) -> List[Tuple[int, float]]:
+    """Запасной путь: прямоугольник по индексу users(latitude, longitude) + гаверсинус, кругами до k результатов"""
+    rows = []
+    for radius in ([radius_km] if radius_km else FALLBACK_RADII_KM):
+        cur.execute(f"""
+            SELECT u.id, {distance_sql('u.latitude', 'u.longitude', lat, lon)} AS distance
+            FROM users u
+            WHERE {radius_sql('u.latitude', 'u.longitude', lat, lon, radius)} AND u.id <> {exclude}
+            ORDER BY distance, u.id
+            LIMIT {limit}
+        """)
+        rows = cur.fetchall()
+        if len(rows) >= limit:
+            break
+    return [(row[0], float(row[1])) for row in rows]
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Люди рядом — k ближайших пользователей или все в радиусе, по возрастанию расстояния, с онлайн-статусом
+    Args: event with httpMethod, queryStringParameters (limit — k, radius в км, необязательно;
+          latitude, longitude — иначе координаты пользователя из БД), headers (X-User-Id)
+          context with request_id
+    Returns: HTTP response with users array (distance_km, status)
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 204,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    headers = event.get('headers') or {}
+    user_id_str = headers.get('X-User-Id') or headers.get('x-user-id')
+    
+    if not user_id_str:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+    
+    params = event.get('queryStringParameters') or {}
+    try:
+        user_id = int(user_id_str)
+        limit = min(max(int(params.get('limit', 20)), 1), MAX_LIMIT)
+        radius_km = float(params['radius']) if params.get('radius') else None
+        latitude = float(params['latitude']) if params.get('latitude') else None
+        longitude = float(params['longitude']) if params.get('longitude') else None
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid limit, radius or coordinates'}),
+            'isBase64Encoded': False
+        }
+    
+    conn = connect()
+    cur = conn.cursor()
+    
+    if latitude is None or longitude is None:
+        cur.execute(f"SELECT latitude, longitude FROM users WHERE id = {user_id}")
+        row = cur.fetchone()
+        if not row or row[0] is None or row[1] is None:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Location unknown, call update-location first'}),
+                'isBase64Encoded': False
+            }
+        latitude, longitude = float(row[0]), float(row[1])
+    
+    # Сетка процесса обновляется событиями update-location; без неё — запрос по индексу координат
+    grid = get_grid()
+    if grid.ready:
+        nearest = grid.nearest(latitude, longitude, limit, max_radius_km=radius_km, exclude=user_id)
+    else:
+        nearest = nearest_from_db(cur, latitude, longitude, limit, radius_km, user_id)
+    
+    users = []
+    if nearest:
+        safe_ids = ','.join(str(nearest_id) for nearest_id, _ in nearest)
+        cur.execute(f"""
+            SELECT id, username, COALESCE(main_photo_url, avatar_url), city, last_activity
+            FROM users WHERE id IN ({safe_ids})
+        """)
+        profiles = {row[0]: row for row in cur.fetchall()}
+        # Онлайн-статусы всей страницы одним обращением к реестру присутствия
+        statuses = get_presence().statuses({profile_id: row[4] for profile_id, row in profiles.items()})
+        
+        for nearest_id, distance in nearest:
+            profile = profiles.get(nearest_id)
+            if not profile:
+                continue
+            _, username, avatar, city, _ = profile
+            users.append({
+                'id': nearest_id,
+                'username': username,
+                'avatar': avatar or fallback_avatar(username),
+                'city': city or '',
+                'distance_km': round(distance, 2),
+                'status': statuses[nearest_id]
+            })
+    
+    cur.close()
+    conn.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'users': users}),
+        'isBase64Encoded': False
+    }
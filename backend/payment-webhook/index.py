@@ -5,9 +5,9 @@ Returns: HTTP 200 response
 '''
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared import energy
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
@@ -58,21 +58,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
+    conn.autocommit = True
     cur = conn.cursor()
     
-    safe_energy_amount = str(int(energy_amount)).replace("'", "''")
-    safe_user_id = str(int(user_id)).replace("'", "''")
-    cur.execute(
-        f"UPDATE users SET energy = energy + {safe_energy_amount} WHERE id = '{safe_user_id}'"
-    )
+    # id платежа — reference операции: повторная доставка webhook не начислит энергию второй раз
+    energy.apply(cur, int(user_id), int(energy_amount), 'payment', reference=payment_object.get('id'))
     
-    conn.commit()
     cur.close()
     conn.close()
     
@@ -1,13 +1,32 @@
 '''
 Business: Send and receive private messages between users
-Args: event with httpMethod, headers (X-User-Id), body with receiverId/text, query params
+Args: event with httpMethod, headers (X-User-Id), body with receiverId/text,
+      query params (otherUserId, limit до 100, beforeId или afterId)
 Returns: HTTP response with messages or send confirmation
 '''
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.blocklist import get_blocklist
+from shared.conversations import is_read_sql, mark_read, pair_filter_sql, record_message
+from shared.db import connect
+from shared.events import NOTIFY_MAX_BYTES, notify_users
+from shared.presence import get_presence
+
+# Жёсткий предел страницы истории
+MAX_LIMIT = 100
+# id и created_at выдаются до COMMIT: сообщение старше курсора afterId может закоммититься уже после опроса.
+# Опрос повторяет сообщения, созданные не раньше чем за AFTER_ID_OVERLAP до курсора; клиент убирает дубли по id
+AFTER_ID_OVERLAP = "interval '5 seconds'"
+
+def format_created_at(created_at) -> str:
+    if hasattr(created_at, 'isoformat'):
+        # Добавляем UTC timezone к времени
+        if created_at.tzinfo is None:
+            from datetime import timezone
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return created_at.isoformat()
+    return str(created_at) + 'Z'
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     print(f'=== HANDLER START ===')
@@ -42,14 +61,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         user_id = int(user_id_str)
         print(f'User ID: {user_id}')
-        dsn = os.environ.get('TIMEWEB_DB_URL')
-        if dsn and '?' in dsn:
-            dsn += '&sslmode=require'
-        elif dsn:
-            dsn += '?sslmode=require'
-        print(f'Connecting to DB with DSN: {dsn[:30]}...')
-        
-        conn = psycopg2.connect(dsn)
+        conn = connect()
         cur = conn.cursor()
         print(f'DB connected successfully')
         
@@ -68,8 +80,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            other_user_id = int(other_user_id_str)
-            limit = int(limit_str)
+            # Курсоры: beforeId — страница старше сообщения (прокрутка вверх), afterId — только новые (опрос)
+            before_id_str = query_params.get('beforeId') or query_params.get('before_id')
+            after_id_str = query_params.get('afterId') or query_params.get('after_id')
+            try:
+                other_user_id = int(other_user_id_str)
+                limit = min(max(int(limit_str), 1), MAX_LIMIT)
+                before_id = int(before_id_str) if before_id_str else None
+                after_id = int(after_id_str) if after_id_str else None
+            except ValueError:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Invalid otherUserId, limit, beforeId or afterId'}),
+                    'isBase64Encoded': False
+                }
             print(f'Other user ID: {other_user_id}')
             print(f'Limit: {limit}')
             
@@ -88,62 +115,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 except Exception as e:
                     print(f'Could not create image_url column: {e}')
             
-            if has_image_url:
-                # Используем подзапрос: берём последние N сообщений (DESC) и переворачиваем обратно (ASC)
-                query = f"""
-                    SELECT * FROM (
-                        SELECT pm.id, pm.sender_id, pm.receiver_id, pm.text, pm.is_read, pm.created_at,
-                               u.username, NULL as avatar_url, pm.voice_url, pm.voice_duration, pm.image_url
-                        FROM private_messages pm
-                        JOIN users u ON u.id = pm.sender_id
-                        WHERE (pm.sender_id = {user_id} AND pm.receiver_id = {other_user_id}) 
-                           OR (pm.sender_id = {other_user_id} AND pm.receiver_id = {user_id})
-                        ORDER BY pm.created_at DESC
-                        LIMIT {limit}
-                    ) AS last_messages
-                    ORDER BY created_at ASC
-                """
-            else:
-                # Fallback without image_url if column doesn't exist
-                query = f"""
-                    SELECT * FROM (
-                        SELECT pm.id, pm.sender_id, pm.receiver_id, pm.text, pm.is_read, pm.created_at,
-                               u.username, NULL as avatar_url, pm.voice_url, pm.voice_duration, NULL as image_url
-                        FROM private_messages pm
-                        JOIN users u ON u.id = pm.sender_id
-                        WHERE (pm.sender_id = {user_id} AND pm.receiver_id = {other_user_id}) 
-                           OR (pm.sender_id = {other_user_id} AND pm.receiver_id = {user_id})
-                        ORDER BY pm.created_at DESC
-                        LIMIT {limit}
-                    ) AS last_messages
-                    ORDER BY created_at ASC
-                """
+            # Страница — один диапазон индекса idx_private_messages_pair_created_at по ключу переписки
+            # (LEAST, GREATEST) и keyset (created_at, id) от сообщения-курсора: цена не зависит от длины переписки.
+            # Берём limit + 1, чтобы узнать, есть ли ещё сообщения за страницей
+            cursor_filter = ''
+            order = 'DESC'
+            if after_id is not None:
+                # С запасом AFTER_ID_OVERLAP до курсора: иначе поздно закоммиченное сообщение не вернётся никогда
+                cursor_filter = (
+                    f"AND pm.id <> {after_id} AND pm.created_at >= "
+                    f"(SELECT created_at FROM private_messages WHERE id = {after_id}) - {AFTER_ID_OVERLAP}"
+                )
+                order = 'ASC'
+            elif before_id is not None:
+                cursor_filter = f"AND (pm.created_at, pm.id) < (SELECT created_at, id FROM private_messages WHERE id = {before_id})"
+            image_url_col = 'pm.image_url' if has_image_url else 'NULL'
+            query = f"""
+                SELECT pm.id, pm.sender_id, pm.receiver_id, pm.text, {is_read_sql('pm')}, pm.created_at,
+                       u.username, COALESCE(u.main_photo_url, u.avatar_url) as avatar_url, pm.voice_url, pm.voice_duration, {image_url_col}
+                FROM private_messages pm
+                JOIN users u ON u.id = pm.sender_id
+                WHERE {pair_filter_sql(user_id, other_user_id)} {cursor_filter}
+                ORDER BY pm.created_at {order}, pm.id {order}
+                LIMIT {limit + 1}
+            """
             print(f'Executing query...')
             cur.execute(query)
             print(f'Query executed')
             
             rows = cur.fetchall()
             print(f'Fetched {len(rows)} rows')
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            if order == 'DESC':
+                # Сообщения в ответе всегда от старых к новым
+                rows.reverse()
             
             messages = []
             for row in rows:
-                created_at = row[5]
-                if hasattr(created_at, 'isoformat'):
-                    # Добавляем UTC timezone к времени
-                    if created_at.tzinfo is None:
-                        from datetime import timezone
-                        created_at = created_at.replace(tzinfo=timezone.utc)
-                    created_at_str = created_at.isoformat()
-                else:
-                    created_at_str = str(created_at) + 'Z'
-                
                 messages.append({
                     'id': row[0],
                     'senderId': row[1],
                     'receiverId': row[2],
                     'text': row[3],
                     'isRead': row[4],
-                    'createdAt': created_at_str,
+                    'createdAt': format_created_at(row[5]),
                     'sender': {'username': row[6] if row[6] else '', 'avatarUrl': row[7] if row[7] else None},
                     'voiceUrl': row[8] if row[8] else None,
                     'voiceDuration': row[9] if row[9] else None,
@@ -152,12 +168,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             print(f'Prepared {len(messages)} messages for response')
             
-            update_query = f"""
-                UPDATE private_messages 
-                SET is_read = TRUE 
-                WHERE receiver_id = {user_id} AND sender_id = {other_user_id} AND is_read = FALSE
-            """
-            cur.execute(update_query)
+            # Прочтение — сдвиг водяного знака в одной строке conversations, private_messages не переписываются
+            last_read_id = mark_read(cur, user_id, other_user_id)
+            
+            if last_read_id is not None:
+                # Отправитель видит прочтение, другие вкладки читателя — обнулённый счётчик
+                notify_users(cur, [
+                    {'userIds': [other_user_id], 'event': {'type': 'read', 'userId': user_id, 'lastReadId': last_read_id}},
+                    {'userIds': [user_id], 'event': {'type': 'unread', 'userId': other_user_id, 'unreadCount': 0}}
+                ])
             conn.commit()
             
             cur.close()
@@ -166,7 +185,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'messages': messages}),
+                'body': json.dumps({'messages': messages, 'hasMore': has_more}),
                 'isBase64Encoded': False
             }
         
@@ -188,14 +207,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            # Проверяем блокировку в обе стороны
-            block_check_query = f"""
-                SELECT COUNT(*) FROM blacklist
-                WHERE (user_id = {user_id} AND blocked_user_id = {receiver_id})
-                   OR (user_id = {receiver_id} AND blocked_user_id = {user_id})
-            """
-            cur.execute(block_check_query)
-            is_blocked = cur.fetchone()[0] > 0
+            # Проверяем блокировку в обе стороны: кэш процесса, в БД — только при промахе
+            is_blocked = get_blocklist().is_blocked(cur, user_id, receiver_id)
             
             if is_blocked:
                 cur.close()
@@ -214,7 +227,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     INSERT INTO private_messages 
                     (sender_id, receiver_id, text, image_url) 
                     VALUES ({user_id}, {receiver_id}, '{escaped_text}', '{escaped_image_url}') 
-                    RETURNING id
+                    RETURNING id, created_at
                 """
             elif voice_url:
                 escaped_voice_url = voice_url.replace("'", "''")
@@ -224,14 +237,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         INSERT INTO private_messages 
                         (sender_id, receiver_id, text, voice_url, voice_duration) 
                         VALUES ({user_id}, {receiver_id}, '{escaped_text}', '{escaped_voice_url}', {voice_duration if voice_duration else 'NULL'}) 
-                        RETURNING id
+                        RETURNING id, created_at
                     """
                 else:
                     insert_query = f"""
                         INSERT INTO private_messages 
                         (sender_id, receiver_id, text, voice_url, voice_duration) 
                         VALUES ({user_id}, {receiver_id}, '', '{escaped_voice_url}', {voice_duration if voice_duration else 'NULL'}) 
-                        RETURNING id
+                        RETURNING id, created_at
                     """
             else:
                 escaped_text = text.replace("'", "''")
@@ -239,16 +252,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     INSERT INTO private_messages 
                     (sender_id, receiver_id, text) 
                     VALUES ({user_id}, {receiver_id}, '{escaped_text}') 
-                    RETURNING id
+                    RETURNING id, created_at
                 """
             cur.execute(insert_query)
-            message_id = cur.fetchone()[0]
+            message_id, created_at = cur.fetchone()
+            
+            # Онлайн-статус отправителя — в реестре присутствия, users.last_activity обновится пакетно
+            get_presence().heartbeat(cur, user_id)
             
-            # Обновляем last_activity отправителя
-            safe_user_id_update = str(user_id).replace("'", "''")
-            cur.execute(
-                f"UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE id = '{safe_user_id_update}'"
-            )
+            # Последнее сообщение и счётчик непрочитанных в списке диалогов обеих сторон
+            unread_count = record_message(cur, message_id, receiver_id)
+            
+            # WebSocket-подписчики получат сообщение и новый счётчик непрочитанных после COMMIT
+            cur.execute(f"""
+                SELECT u.username, COALESCE(u.main_photo_url, u.avatar_url)
+                FROM users u WHERE u.id = {user_id}
+            """)
+            sender_username, sender_avatar = cur.fetchone()
+            message = {
+                'id': message_id,
+                'senderId': user_id,
+                'receiverId': int(receiver_id),
+                'text': text,
+                'isRead': False,
+                'createdAt': format_created_at(created_at),
+                'sender': {'username': sender_username or '', 'avatarUrl': sender_avatar or None},
+                'voiceUrl': voice_url or None,
+                'voiceDuration': voice_duration or None,
+                'imageUrl': image_url or None
+            }
+            if len(json.dumps(message)) > NOTIFY_MAX_BYTES - 500:
+                # Не влезает в NOTIFY: клиент догрузит сообщение обычным GET
+                message = {'id': message_id, 'senderId': user_id, 'receiverId': int(receiver_id), 'partial': True}
+            notify_users(cur, [
+                {'userIds': [int(receiver_id), user_id], 'event': {'type': 'message', 'message': message}},
+                {'userIds': [int(receiver_id)], 'event': {'type': 'unread', 'userId': user_id, 'unreadCount': unread_count}}
+            ])
             
             conn.commit()
             cur.close()
@@ -5,9 +5,9 @@ Returns: HTTP response with photos list or operation status
 '''
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared.avatars import refresh_main_photo
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
@@ -43,9 +43,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     user_id = int(user_id_str)
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     if method == 'GET':
@@ -83,6 +81,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 f"INSERT INTO user_photos (user_id, photo_url) VALUES ({user_id}, '{photo_url_escaped}') RETURNING id"
             )
             photo_id = cur.fetchone()[0]
+            refresh_main_photo(cur, user_id)
             conn.commit()
             cur.close()
             conn.close()
@@ -151,6 +150,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             f"INSERT INTO user_photos (user_id, photo_url) VALUES ({post_user_id}, '{photo_url_escaped}') RETURNING id"
         )
         photo_id = cur.fetchone()[0]
+        refresh_main_photo(cur, post_user_id)
         conn.commit()
         cur.close()
         conn.close()
@@ -184,6 +184,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur.execute(
             f"UPDATE user_photos SET display_order = 0 WHERE id = {photo_id} AND user_id = {user_id}"
         )
+        refresh_main_photo(cur, user_id)
         
         conn.commit()
         cur.close()
@@ -216,6 +217,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             f"DELETE FROM user_photos WHERE id = {photo_id} AND user_id = {user_id}"
         )
         affected = cur.rowcount
+        if affected:
+            refresh_main_photo(cur, user_id)
         conn.commit()
         cur.close()
         conn.close()
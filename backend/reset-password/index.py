@@ -1,8 +1,7 @@
 import json
-import os
-import psycopg2
 import hashlib
 from typing import Dict, Any
+from shared.db import connect
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -54,12 +53,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     safe_phone = phone.replace("'", "''")
@@ -1,7 +1,6 @@
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
 import hashlib
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -35,13 +34,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     password_hash = hashlib.sha256("test123".encode()).hexdigest()
@@ -134,7 +127,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     except:
                         pass
                     # Переподключаемся
-                    conn = psycopg2.connect(dsn)
+                    conn = connect()
                     cur = conn.cursor()
                     # Создаём без city
                     cur.execute(f"""
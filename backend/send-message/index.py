@@ -1,7 +1,203 @@
 import json
 import os
+from typing import Dict, Any, List
 import psycopg2
-from typing import Dict, Any
+from shared.db import connect
+from shared.avatars import fallback_avatar_sql
+from shared.energy import MAX_ATTEMPTS, MESSAGE_COST, append_sql, balance_sql
+from shared.events import CHAT_MESSAGES_CHANNEL
+from shared.group_commit import GroupCommit
+from shared.hot_window import get_window
+from shared.presence import get_presence
+
+# Group commit: отправки, пришедшие за SEND_MESSAGE_BATCH_MS, пишутся одним запросом и одним COMMIT.
+# 0 — выключено, каждая отправка идёт своим запросом
+SEND_MESSAGE_BATCH_MS = float(os.environ.get('SEND_MESSAGE_BATCH_MS', '0'))
+SEND_MESSAGE_BATCH_MAX = int(os.environ.get('SEND_MESSAGE_BATCH_MAX', '64'))
+
+def notify_sql(id_col: str, text_col: str, created_at_col: str, author: str) -> str:
+    """pg_notify нового сообщения в формате get-messages: подписчики SSE и горячие окна других процессов получат его после COMMIT"""
+    return f"""pg_notify('{CHAT_MESSAGES_CHANNEL}', json_build_object(
+                    'message', json_build_object(
+                        'id', {id_col},
+                        'text', {text_col},
+                        'created_at', to_char({created_at_col}, 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'),
+                        'user', json_build_object('id', {author}.id, 'username', {author}.username, 'avatar', {author}.avatar),
+                        'reactions', '[]'::json
+                    ),
+                    'latitude', {author}.latitude::float8,
+                    'longitude', {author}.longitude::float8
+                )::text)"""
+
+def send_one(user_id, text: str) -> tuple:
+    """
+    Одна отправка одним запросом в autocommit. Возвращает (found, is_banned, balance, energy, message_id,
+    created_at, username, latitude, longitude, avatar); message_id None — сообщение не записано
+    """
+    conn = connect()
+    # Списание, вставка и NOTIFY — один запрос, отдельный COMMIT не нужен
+    conn.autocommit = True
+    cur = conn.cursor()
+    
+    # Use simple query protocol
+    safe_user_id = str(user_id).replace("'", "''")
+    safe_text = text.replace("'", "''")
+    # Списание — строка журнала energy_transactions от текущего баланса при balance >= MESSAGE_COST.
+    # Две одновременные отправки претендуют на один seq: вторая получает 0 строк и повторяет запрос
+    # уже от нового баланса, так что последние 10 энергии тратятся один раз.
+    # author читается из снимка запроса и нужен для причины отказа и полей события
+    charge_condition = f"NOT COALESCE(u.is_banned, FALSE) AND cur.balance >= {MESSAGE_COST}"
+    for _ in range(MAX_ATTEMPTS):
+        cur.execute(f"""
+            WITH author AS (
+                SELECT u.id, u.is_banned, u.username, u.latitude, u.longitude,
+                       COALESCE(u.main_photo_url, {fallback_avatar_sql('u.username')}) AS avatar,
+                       {balance_sql('u.id', 'u.energy')} AS balance
+                FROM users u WHERE u.id = '{safe_user_id}'
+            ),
+            charged AS ({append_sql(user_id, -MESSAGE_COST, 'message', condition=charge_condition)}),
+            inserted AS (
+                INSERT INTO messages (user_id, text)
+                SELECT '{safe_user_id}', '{safe_text}' FROM charged
+                RETURNING id, text, created_at
+            ),
+            notified AS (
+                SELECT {notify_sql('i.id', 'i.text', 'i.created_at', 'a')}
+                FROM inserted i, author a
+            )
+            SELECT a.id IS NOT NULL, COALESCE(a.is_banned, FALSE), a.balance, c.balance,
+                   i.id, i.created_at, a.username, a.latitude, a.longitude, a.avatar,
+                   (SELECT COUNT(*) FROM notified)
+            FROM (SELECT 1) AS one
+            LEFT JOIN author a ON TRUE
+            LEFT JOIN charged c ON TRUE
+            LEFT JOIN inserted i ON TRUE
+            """)
+        found, is_banned, balance, energy, message_id, created_at, username, author_lat, author_lon, avatar, _ = cur.fetchone()
+        # Повтор нужен только если энергии хватало, а seq занят параллельной операцией
+        if message_id is not None or not found or is_banned or balance < MESSAGE_COST:
+            break
+    if message_id is not None:
+        get_presence().heartbeat(cur, user_id)
+    cur.close()
+    conn.close()
+    return found, is_banned, balance, energy, message_id, created_at, username, author_lat, author_lon, avatar
+
+def send_batch(items: List[tuple]) -> List[Any]:
+    """
+    Пачка отправок (user_id, text) одним запросом и одним COMMIT, результаты в формате send_one по порядку.
+    Несколько сообщений одного автора в пачке списываются подряд: n-е проходит, если баланса хватает на n.
+    Если seq автора за это время занял другой процесс, пачка откатывается целиком и уходит по одной
+    """
+    results: List[Any] = [None] * len(items)
+    rows = []
+    for idx, (user_id, text) in enumerate(items):
+        try:
+            safe_user_id = int(user_id)
+            text.encode('utf-8')
+            if '\x00' in text:
+                raise ValueError('text contains NUL')
+        except (TypeError, ValueError) as e:
+            # Ошибка остаётся у своей отправки и не попадает в общий запрос пачки
+            results[idx] = e
+            continue
+        safe_text = text.replace("'", "''")
+        rows.append(f"({idx}, {safe_user_id}, '{safe_text}')")
+    if not rows:
+        return results
+    
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            WITH req (idx, user_id, text) AS (
+                VALUES {', '.join(rows)}
+            ),
+            author AS (
+                SELECT u.id, u.is_banned, u.username, u.latitude, u.longitude,
+                       COALESCE(u.main_photo_url, {fallback_avatar_sql('u.username')}) AS avatar,
+                       COALESCE(t.seq, 0) AS seq, COALESCE(t.balance, u.energy, 0) AS balance
+                FROM users u
+                LEFT JOIN LATERAL (
+                    SELECT seq, balance FROM energy_transactions
+                    WHERE user_id = u.id
+                    ORDER BY seq DESC
+                    LIMIT 1
+                ) t ON TRUE
+                WHERE u.id IN (SELECT user_id FROM req)
+            ),
+            ranked AS (
+                SELECT r.idx, r.user_id, r.text, row_number() OVER (PARTITION BY r.user_id ORDER BY r.idx) AS n
+                FROM req r
+                JOIN author a ON a.id = r.user_id
+                WHERE NOT COALESCE(a.is_banned, FALSE)
+            ),
+            accepted AS (
+                SELECT k.idx, k.user_id, k.text, a.seq + k.n AS seq, a.balance - k.n * {MESSAGE_COST} AS balance,
+                       nextval(pg_get_serial_sequence('messages', 'id')) AS message_id
+                FROM ranked k
+                JOIN author a ON a.id = k.user_id
+                WHERE a.balance >= k.n * {MESSAGE_COST}
+                ORDER BY k.idx
+            ),
+            -- Без ON CONFLICT: занятый seq означает устаревший снимок баланса, и пачка не должна записаться
+            charged AS (
+                INSERT INTO energy_transactions (user_id, seq, amount, balance, reason)
+                SELECT user_id, seq, -{MESSAGE_COST}, balance, 'message' FROM accepted
+                RETURNING id
+            ),
+            inserted AS (
+                INSERT INTO messages (id, user_id, text)
+                SELECT message_id, user_id, text FROM accepted
+                RETURNING id, created_at
+            ),
+            notified AS (
+                SELECT {notify_sql('ac.message_id', 'ac.text', 'i.created_at', 'a')}
+                FROM (SELECT * FROM accepted ORDER BY idx) ac
+                JOIN inserted i ON i.id = ac.message_id
+                JOIN author a ON a.id = ac.user_id
+            )
+            SELECT r.idx, a.id IS NOT NULL, COALESCE(a.is_banned, FALSE),
+                   a.balance - (COALESCE(k.n, 1) - 1) * {MESSAGE_COST}, ac.balance,
+                   i.id, i.created_at, a.username, a.latitude, a.longitude, a.avatar,
+                   (SELECT COUNT(*) FROM notified), (SELECT COUNT(*) FROM charged)
+            FROM req r
+            LEFT JOIN author a ON a.id = r.user_id
+            LEFT JOIN ranked k ON k.idx = r.idx
+            LEFT JOIN accepted ac ON ac.idx = r.idx
+            LEFT JOIN inserted i ON i.id = ac.message_id
+            ORDER BY r.idx
+        """)
+        for row in cur.fetchall():
+            results[row[0]] = tuple(row[1:11])
+        presence = get_presence()
+        for user_id in {items[idx][0] for idx, result in enumerate(results) if isinstance(result, tuple) and result[4] is not None}:
+            presence.heartbeat(cur, user_id)
+        conn.commit()
+    except Exception as e:
+        # UniqueViolation — seq автора занят параллельной операцией; любая другая ошибка пачки тоже не должна
+        # достаться всем её участникам: каждая отправка повторяется отдельно и получает свой результат
+        if not isinstance(e, psycopg2.errors.UniqueViolation):
+            print(f'[SEND-MESSAGE] batch of {len(items)} failed, sending one by one: {e}')
+        conn.rollback()
+        cur.close()
+        conn.close()
+        return [
+            result if result is not None else send_one_or_error(*items[idx])
+            for idx, result in enumerate(results)
+        ]
+    cur.close()
+    conn.close()
+    return results
+
+def send_one_or_error(user_id, text: str) -> Any:
+    """send_one для отката пачки: ошибка одной отправки становится её результатом, а не ошибкой всей пачки"""
+    try:
+        return send_one(user_id, text)
+    except Exception as e:
+        return e
+
+batcher = GroupCommit('send-message', send_batch, SEND_MESSAGE_BATCH_MS, SEND_MESSAGE_BATCH_MAX) if SEND_MESSAGE_BATCH_MS > 0 else None
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -35,7 +231,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     body_data = json.loads(event.get('body', '{}'))
     user_id = body_data.get('user_id')
-    text = body_data.get('text', '').strip()
+    text = body_data.get('text', '')
+    text = text.strip() if isinstance(text, str) else ''
     
     if not user_id or not text:
         return {
@@ -45,6 +242,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    # Текст проверяется до пачки group commit: одиночный суррогат (не кодируется в UTF-8) или NUL
+    # (Postgres не хранит его в text) иначе сломали бы общий запрос
+    try:
+        int(user_id)
+        text.encode('utf-8')
+        valid = '\x00' not in text
+    except (TypeError, ValueError):
+        valid = False
+    
+    if not valid:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Invalid user ID or text'}),
+            'isBase64Encoded': False
+        }
+    
     if len(text) > 140:
         return {
             'statusCode': 400,
@@ -53,22 +267,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
+    if batcher is not None:
+        result = batcher.submit((user_id, text))
+    else:
+        result = send_one(user_id, text)
+    found, is_banned, balance, energy, message_id, created_at, username, author_lat, author_lon, avatar = result
     
-    # Use simple query protocol
-    safe_user_id = str(user_id).replace("'", "''")
-    cur.execute(f"SELECT energy, is_banned FROM users WHERE id = '{safe_user_id}'")
-    user_data = cur.fetchone()
-    
-    if not user_data:
-        cur.close()
-        conn.close()
+    if not found:
         return {
             'statusCode': 404,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -76,12 +281,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    energy = user_data[0]
-    is_banned = user_data[1] if len(user_data) > 1 and user_data[1] is not None else False
-    
     if is_banned:
-        cur.close()
-        conn.close()
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -89,9 +289,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    if energy < 10:
-        cur.close()
-        conn.close()
+    if message_id is None and balance >= MESSAGE_COST:
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Too many concurrent energy operations, retry'}),
+            'isBase64Encoded': False
+        }
+    
+    if message_id is None:
         return {
             'statusCode': 402,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -99,20 +305,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    cur.execute(
-        f"UPDATE users SET energy = energy - 10, last_activity = CURRENT_TIMESTAMP WHERE id = '{safe_user_id}'"
-    )
-    
-    # Escape single quotes in text
-    safe_text = text.replace("'", "''")
-    cur.execute(
-        f"INSERT INTO messages (user_id, text) VALUES ('{safe_user_id}', '{safe_text}') RETURNING id, created_at"
-    )
-    message_id, created_at = cur.fetchone()
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Своё окно обновляем сразу, не дожидаясь NOTIFY: автор увидит сообщение при следующем запросе ленты
+    get_window().add_message({
+        'message': {
+            'id': message_id,
+            'text': text,
+            'created_at': created_at.isoformat() + 'Z',
+            'user': {
+                'id': int(user_id),
+                'username': username,
+                'avatar': avatar
+            },
+            'reactions': []
+        },
+        'latitude': float(author_lat) if author_lat is not None else None,
+        'longitude': float(author_lon) if author_lon is not None else None
+    })
     
     return {
         'statusCode': 200,
@@ -122,7 +330,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'user_id': user_id,
             'text': text,
             'created_at': created_at.isoformat(),
-            'energy': energy - 10
+            'energy': energy
         }),
         'isBase64Encoded': False
-    }
\ No newline at end of file
+    }
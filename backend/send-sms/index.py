@@ -1,8 +1,8 @@
 import json
 import os
 import random
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
 from datetime import datetime, timedelta
 import urllib.request
 import urllib.parse
@@ -64,12 +64,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         code = str(random.randint(1000, 9999))
     
     # Сохраняем в БД
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     # Удаляем старые коды для этого телефона
@@ -0,0 +1,4 @@
+'''
+Общий код backend функций: пул соединений с БД и вспомогательные модули.
+Функции импортируют его как `shared.*` — каталог backend/ добавляется в sys.path в server.py.
+'''
@@ -0,0 +1,46 @@
+'''
+Business: Аватарка пользователя — денормализованная users.main_photo_url и запасной вариант dicebear
+Args: курсор открытой транзакции profile-photos, id пользователя
+Returns: main_photo_url, пересчитанная из user_photos в той же транзакции
+'''
+
+from typing import Optional
+
+from shared.events import FEED_EVENTS_CHANNEL, notify
+
+
+DICEBEAR_URL = 'https://api.dicebear.com/7.x/avataaars/svg?seed='
+
+
+def fallback_avatar(username: str) -> str:
+    return f'{DICEBEAR_URL}{username}'
+
+
+def fallback_avatar_sql(username_col: str) -> str:
+    '''То же, что fallback_avatar, для запросов, собирающих аватарку в SQL'''
+    return f"'{DICEBEAR_URL}' || {username_col}"
+
+
+def refresh_main_photo(cur, user_id: int) -> Optional[str]:
+    '''Вызывать после любой записи в user_photos, до COMMIT. Горячее окно чата получит новую аватарку после COMMIT'''
+    cur.execute(f"""
+        UPDATE users
+        SET main_photo_url = (
+            SELECT photo_url FROM user_photos
+            WHERE user_id = {int(user_id)}
+            ORDER BY display_order ASC, created_at DESC
+            LIMIT 1
+        )
+        WHERE id = {int(user_id)}
+        RETURNING main_photo_url, username
+    """)
+    row = cur.fetchone()
+    if not row:
+        return None
+    main_photo_url, username = row
+    notify(cur, FEED_EVENTS_CHANNEL, {
+        'type': 'avatar',
+        'userId': int(user_id),
+        'avatar': main_photo_url or fallback_avatar(username)
+    })
+    return main_photo_url
@@ -0,0 +1,118 @@
+'''
+Business: Блокировки между пользователями в памяти процесса — для проверки перед личным сообщением и фильтра ленты
+Args: множества загружаются лениво из blacklist по первому запросу пользователя; blacklist POST/DELETE
+      сбрасывает их в своём процессе и через BLOCKLIST_CHANNEL в остальных
+Returns: id всех, с кем у пользователя блокировка в любую сторону, без запроса в БД при попадании в кэш
+'''
+
+import os
+import threading
+from typing import Dict, FrozenSet, Iterable, Optional
+
+# Сколько пользователей держать в кэше (LRU)
+BLOCKLIST_CACHE_USERS = int(os.environ.get('BLOCKLIST_CACHE_USERS', '100000'))
+
+
+def related_sql(user_id_expr: str) -> str:
+    '''SQL: id пользователей, с которыми у user_id_expr блокировка в любую сторону (индексы по обеим колонкам)'''
+    return f"""
+        SELECT blocked_user_id FROM blacklist WHERE user_id = {user_id_expr}
+        UNION
+        SELECT user_id FROM blacklist WHERE blocked_user_id = {user_id_expr}
+    """
+
+
+def not_related_sql(user_id_col: str, user_id_expr: str) -> str:
+    '''
+    SQL-условие "у user_id_expr нет блокировки с автором user_id_col" для WHERE ленты при промахе кэша:
+    anti-join по индексам blacklist в том же запросе вместо отдельного related()
+    '''
+    return f"""NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.user_id = {user_id_expr} AND b.blocked_user_id = {user_id_col})
+        AND NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.blocked_user_id = {user_id_expr} AND b.user_id = {user_id_col})"""
+
+
+def exclude_sql(user_id_col: str, related: FrozenSet[int]) -> Optional[str]:
+    '''
+    SQL-условие "автор не из related" для WHERE ленты, до LIMIT — страница остаётся ровно limit.
+    Массив-константу Postgres проверяет хешем, поэтому сотни блокировок не замедляют скан
+    '''
+    if not related:
+        return None
+    ids = ','.join(str(int(user_id)) for user_id in sorted(related))
+    return f"NOT ({user_id_col} = ANY('{{{ids}}}'::int[]))"
+
+
+class BlockList:
+    '''
+    Кэшу можно верить, только пока pg-listener получает события: до reset() (вызывается при каждом
+    (пере)подключении слушателя) множества читаются из БД, но не запоминаются. Номер поколения
+    не даёт положить в кэш множество, прочитанное до сброса, который случился во время чтения.
+    '''
+
+    def __init__(self, size: int = BLOCKLIST_CACHE_USERS):
+        self.size = size
+        self.ready = False
+        self._lock = threading.Lock()
+        self._related: Dict[int, FrozenSet[int]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._related = {}
+            self._generation += 1
+            self.ready = True
+
+    def peek(self, user_id: int) -> Optional[FrozenSet[int]]:
+        '''Множество из кэша или None — тогда нужен related() с курсором'''
+        with self._lock:
+            cached = self._related.pop(int(user_id), None)
+            if cached is not None:
+                self._related[int(user_id)] = cached
+                self.hits += 1
+            return cached
+
+    def related(self, cur, user_id: int) -> FrozenSet[int]:
+        user_id = int(user_id)
+        cached = self.peek(user_id)
+        if cached is not None:
+            return cached
+        with self._lock:
+            self.misses += 1
+            generation = self._generation
+
+        cur.execute(related_sql(str(user_id)))
+        related = frozenset(row[0] for row in cur.fetchall())
+
+        with self._lock:
+            if self.ready and generation == self._generation:
+                self._related[user_id] = related
+                if len(self._related) > self.size:
+                    del self._related[next(iter(self._related))]
+        return related
+
+    def is_blocked(self, cur, user_id: int, other_user_id: int) -> bool:
+        '''Блокировка между двумя пользователями в любую сторону'''
+        return int(other_user_id) in self.related(cur, user_id)
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                self._related.pop(int(user_id), None)
+            self._generation += 1
+
+    def apply(self, payload) -> None:
+        '''Событие BLOCKLIST_CHANNEL: {'userId', 'blockedUserId'}'''
+        self.invalidate([payload['userId'], payload['blockedUserId']])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'ready': self.ready, 'users': len(self._related), 'hits': self.hits, 'misses': self.misses}
+
+
+_blocklist = BlockList()
+
+
+def get_blocklist() -> BlockList:
+    return _blocklist
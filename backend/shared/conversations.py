@@ -0,0 +1,69 @@
+'''
+Business: Личные переписки — ключ пары для запросов к private_messages и таблица диалогов conversations
+Args: id собеседников в любом порядке; курсор транзакции private-messages
+Returns: SQL-условия, совпадающие с индексом idx_private_messages_pair_created_at; счётчики непрочитанных
+'''
+
+from typing import Optional
+
+
+def pair_sql(alias: str = 'pm') -> str:
+    '''Выражения ключа переписки — в том же виде, что в индексе, иначе планировщик его не использует'''
+    return f'LEAST({alias}.sender_id, {alias}.receiver_id), GREATEST({alias}.sender_id, {alias}.receiver_id)'
+
+
+def pair_filter_sql(user_id: int, other_user_id: int, alias: str = 'pm') -> str:
+    '''Все сообщения между двумя пользователями в обе стороны'''
+    low, high = sorted((int(user_id), int(other_user_id)))
+    return f'({pair_sql(alias)}) = ({low}, {high})'
+
+
+def record_message(cur, message_id: int, receiver_id: int) -> int:
+    '''
+    Обновляет строки conversations обеих сторон после вставки личного сообщения (в той же транзакции).
+    Возвращает новый счётчик непрочитанных у получателя
+    '''
+    # Строки блокируются по возрастанию user_id: встречные сообщения пары не дают deadlock
+    cur.execute(f"""
+        INSERT INTO conversations (user_id, other_user_id, last_message_id, last_message, last_message_at, unread_count)
+        SELECT side.user_id, side.other_user_id, pm.id, pm.text, pm.created_at, side.unread
+        FROM private_messages pm
+        CROSS JOIN LATERAL (
+            VALUES (pm.sender_id, pm.receiver_id, 0), (pm.receiver_id, pm.sender_id, 1)
+        ) AS side (user_id, other_user_id, unread)
+        WHERE pm.id = {int(message_id)} AND (side.unread = 0 OR pm.receiver_id <> pm.sender_id)
+        ORDER BY side.user_id
+        ON CONFLICT (user_id, other_user_id) DO UPDATE SET
+            last_message_id = GREATEST(conversations.last_message_id, EXCLUDED.last_message_id),
+            last_message = CASE WHEN EXCLUDED.last_message_id > conversations.last_message_id
+                                THEN EXCLUDED.last_message ELSE conversations.last_message END,
+            last_message_at = CASE WHEN EXCLUDED.last_message_id > conversations.last_message_id
+                                   THEN EXCLUDED.last_message_at ELSE conversations.last_message_at END,
+            unread_count = conversations.unread_count + EXCLUDED.unread_count
+        RETURNING user_id, unread_count
+    """)
+    return dict(cur.fetchall()).get(int(receiver_id), 0)
+
+
+def mark_read(cur, user_id: int, other_user_id: int) -> Optional[int]:
+    '''
+    Сдвигает водяной знак читателя на последнее сообщение диалога и обнуляет счётчик — одна строка
+    conversations. Возвращает новый знак или None, если непрочитанных не было. Отправка, которая
+    закоммитилась раньше, попадёт под знак; более поздняя увеличит счётчик уже после него
+    '''
+    cur.execute(f"""
+        UPDATE conversations
+        SET last_read_message_id = GREATEST(last_read_message_id, last_message_id), unread_count = 0
+        WHERE user_id = {int(user_id)} AND other_user_id = {int(other_user_id)} AND unread_count > 0
+        RETURNING last_read_message_id
+    """)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def is_read_sql(alias: str = 'pm') -> str:
+    '''isRead сообщения: его id не выше водяного знака получателя в диалоге с отправителем'''
+    return f"""{alias}.id <= COALESCE((
+                SELECT w.last_read_message_id FROM conversations w
+                WHERE w.user_id = {alias}.receiver_id AND w.other_user_id = {alias}.sender_id
+            ), 0)"""
@@ -0,0 +1,288 @@
+'''
+Business: Общий пул соединений с Postgres для всех backend функций
+Args: TIMEWEB_DB_URL и переменные DB_POOL_* (размер, таймауты, переиспользование)
+Returns: connect() выдаёт соединение из пула, conn.close() возвращает его обратно
+'''
+
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, Dict, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '10'))
+# Соединение закрывается и пересоздаётся после N выдач из пула
+POOL_MAX_USES = int(os.environ.get('DB_POOL_MAX_USES', '1000'))
+# Сколько секунд ждать свободное соединение, прежде чем вернуть ошибку
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', '5'))
+# Соединение, пролежавшее без дела дольше N секунд, проверяется SELECT 1 перед выдачей
+POOL_HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+# Лишние (сверх POOL_MIN_SIZE) простаивающие соединения закрываются через N секунд
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+# Как часто ожидающий соединение поток сам разбирает соединения, потерянные без close()
+DISCARD_POLL_INTERVAL = 0.1
+
+
+class PoolTimeout(Exception):
+    '''Все соединения пула заняты дольше checkout timeout'''
+
+
+def get_dsn() -> Optional[str]:
+    '''TIMEWEB_DB_URL с sslmode=require, как раньше делала каждая функция'''
+    dsn = os.environ.get('TIMEWEB_DB_URL')
+    if not dsn or 'sslmode=' in dsn:
+        return dsn
+    if '?' in dsn:
+        return dsn + '&sslmode=require'
+    return dsn + '?sslmode=require'
+
+
+class _Entry:
+    __slots__ = ('raw', 'uses', 'last_used')
+
+    def __init__(self, raw: Any):
+        self.raw = raw
+        self.uses = 0
+        self.last_used = time.monotonic()
+
+
+class PooledConnection:
+    '''
+    Обёртка над psycopg2 connection: всё проксируется в настоящее соединение,
+    а close() возвращает его в пул вместо разрыва TCP/TLS сессии.
+    '''
+
+    def __init__(self, pool: 'ConnectionPool', entry: _Entry):
+        self._pool = pool
+        self._entry = entry
+        # Если функция упала и не вызвала close(), соединение не должно потеряться для пула
+        self._finalizer = weakref.finalize(self, pool._discard, entry)
+
+    def __getattr__(self, name: str) -> Any:
+        entry = self.__dict__.get('_entry')
+        if entry is None:
+            raise psycopg2.InterfaceError('connection already returned to pool')
+        return getattr(entry.raw, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in ('_pool', '_entry', '_finalizer'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._entry.raw, name, value)
+
+    @property
+    def closed(self) -> int:
+        return 1 if self._entry is None else self._entry.raw.closed
+
+    def close(self) -> None:
+        entry = self._entry
+        if entry is None:
+            return
+        self._finalizer.detach()
+        object.__setattr__(self, '_entry', None)
+        self._pool._release(entry)
+
+    def __enter__(self) -> 'PooledConnection':
+        self._entry.raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._entry.raw.__exit__(exc_type, exc, tb)
+
+
+class ConnectionPool:
+    '''Потокобезопасный пул: min/max размер, health check, recycle после N использований'''
+
+    def __init__(
+        self,
+        dsn: Optional[str],
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        max_uses: int = POOL_MAX_USES,
+        checkout_timeout: float = POOL_CHECKOUT_TIMEOUT,
+        healthcheck_after: float = POOL_HEALTHCHECK_AFTER,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+    ):
+        self.dsn = dsn
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.max_uses = max_uses
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_after = healthcheck_after
+        self.idle_timeout = idle_timeout
+        self._idle: deque = deque()
+        self._lock = threading.Lock()
+        # Семафор ограничивает число одновременно выданных соединений
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        # Соединения, чьи обёртки собрал GC: финализатор может сработать в потоке, который уже держит
+        # self._lock или блокировку семафора, поэтому он только кладёт entry сюда (append атомарен),
+        # а закрывают и возвращают слот connect()/_release()
+        self._discarded: deque = deque()
+        self._stats = {'created': 0, 'reused': 0, 'recycled': 0, 'broken': 0, 'timeouts': 0, 'in_use': 0}
+
+    def _open(self) -> _Entry:
+        raw = psycopg2.connect(self.dsn)
+        with self._lock:
+            self._stats['created'] += 1
+        return _Entry(raw)
+
+    def _close_raw(self, entry: _Entry) -> None:
+        try:
+            entry.raw.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, entry: _Entry) -> bool:
+        if entry.raw.closed:
+            return False
+        if time.monotonic() - entry.last_used < self.healthcheck_after:
+            return True
+        try:
+            with entry.raw.cursor() as cur:
+                cur.execute('SELECT 1')
+            entry.raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def warmup(self) -> None:
+        '''Открыть min_size соединений заранее, чтобы первые запросы не ждали handshake'''
+        while True:
+            with self._lock:
+                if len(self._idle) + self._stats['in_use'] >= self.min_size:
+                    return
+            entry = self._open()
+            with self._lock:
+                self._idle.append(entry)
+
+    def connect(self) -> PooledConnection:
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            self._drain_discarded()
+            remaining = deadline - time.monotonic()
+            # Ждём короткими отрезками: слот, потерянный GC, вернётся только при следующем разборе _discarded
+            if self._slots.acquire(timeout=max(0.0, min(remaining, DISCARD_POLL_INTERVAL))):
+                break
+            if remaining <= DISCARD_POLL_INTERVAL:
+                self._drain_discarded()
+                if self._slots.acquire(blocking=False):
+                    break
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise PoolTimeout(f'No free DB connection within {self.checkout_timeout}s')
+
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    entry = self._open()
+                    break
+                if self._is_healthy(entry):
+                    with self._lock:
+                        self._stats['reused'] += 1
+                    break
+                with self._lock:
+                    self._stats['broken'] += 1
+                self._close_raw(entry)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['in_use'] += 1
+        return PooledConnection(self, entry)
+
+    def _release(self, entry: _Entry) -> None:
+        raw = entry.raw
+        keep = not raw.closed
+        if keep and raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Незакоммиченные изменения не должны достаться следующему запросу
+            try:
+                raw.rollback()
+            except Exception:
+                keep = False
+        if keep and raw.autocommit:
+            raw.autocommit = False
+
+        entry.uses += 1
+        entry.last_used = time.monotonic()
+        recycle = entry.uses >= self.max_uses
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if not keep:
+                self._stats['broken'] += 1
+            elif recycle:
+                self._stats['recycled'] += 1
+            else:
+                self._idle.append(entry)
+            expired = self._trim_idle()
+
+        if not keep or recycle:
+            self._close_raw(entry)
+        for old in expired:
+            self._close_raw(old)
+        self._slots.release()
+        self._drain_discarded()
+
+    def _discard(self, entry: _Entry) -> None:
+        '''Соединение выдано, но обёртку собрал GC без close(): только в очередь, без блокировок'''
+        self._discarded.append(entry)
+
+    def _drain_discarded(self) -> None:
+        '''Закрывает соединения из _discarded и возвращает их слоты; вызывать без self._lock'''
+        while True:
+            try:
+                entry = self._discarded.popleft()
+            except IndexError:
+                return
+            self._close_raw(entry)
+            with self._lock:
+                self._stats['in_use'] -= 1
+                self._stats['broken'] += 1
+            self._slots.release()
+
+    def _trim_idle(self) -> list:
+        '''Вызывается под self._lock; самые старые соединения лежат в начале deque'''
+        expired = []
+        now = time.monotonic()
+        while len(self._idle) > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+            expired.append(self._idle.popleft())
+        return expired
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for entry in idle:
+            self._close_raw(entry)
+
+    def stats(self) -> Dict[str, int]:
+        self._drain_discarded()
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle), max_size=self.max_size)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    '''Один пул на процесс, общий для всех функций'''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(get_dsn())
+    return _pool
+
+
+def connect() -> PooledConnection:
+    '''Замена psycopg2.connect(dsn): соединение берётся из пула и возвращается в него по close()'''
+    return get_pool().connect()
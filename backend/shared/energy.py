@@ -0,0 +1,136 @@
+'''
+Business: Баланс энергии — журнал energy_transactions только на добавление вместо UPDATE users.energy
+Args: курсор соединения функции; операции — (user_id, amount, reason[, reference])
+Returns: новый баланс; текущий баланс — последняя строка журнала, у новых пользователей — users.energy
+'''
+
+from typing import Optional
+
+# Стоимость сообщения в общем чате
+MESSAGE_COST = 10
+# Сколько раз повторять операцию, если параллельная операция того же пользователя заняла seq.
+# Каждый конфликт значит, что другая операция закоммитилась, поэтому N одновременных операций
+# одного пользователя проходят максимум за N попыток
+MAX_ATTEMPTS = 20
+
+
+class EnergyConflict(Exception):
+    '''Операция не прошла за MAX_ATTEMPTS попыток из-за параллельных операций того же пользователя'''
+
+
+def _escape(value) -> str:
+    return str(value).replace("'", "''")
+
+
+def balance_sql(user_id_col: str, opening_col: str) -> str:
+    '''
+    SQL-выражение текущего баланса: последняя строка журнала (по индексу user_id, seq) или стартовый users.energy.
+    Колонки передавать с алиасом таблицы: голый id внутри подзапроса означал бы energy_transactions.id
+    '''
+    return f"""COALESCE((
+            SELECT t.balance FROM energy_transactions t
+            WHERE t.user_id = {user_id_col}
+            ORDER BY t.seq DESC
+            LIMIT 1
+        ), {opening_col})"""
+
+
+def append_sql(user_id, amount: int, reason: str, reference: Optional[str] = None,
+               condition: str = 'TRUE') -> str:
+    '''
+    INSERT ... RETURNING seq, balance для CTE: новая строка журнала от текущего баланса.
+    condition — дополнительное условие на текущий баланс (cur.balance) и пользователя (u);
+    если оно ложно, пользователя нет или seq уже занят параллельной операцией, строк не будет.
+    '''
+    safe_user_id = _escape(user_id)
+    safe_reference = f"'{_escape(reference)}'" if reference is not None else 'NULL'
+    return f"""
+            INSERT INTO energy_transactions (user_id, seq, amount, balance, reason, reference)
+            SELECT u.id, cur.seq + 1, {int(amount)}, cur.balance + {int(amount)}, '{_escape(reason)}', {safe_reference}
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT seq, balance FROM energy_transactions
+                WHERE user_id = u.id
+                ORDER BY seq DESC
+                LIMIT 1
+            ) t ON TRUE
+            CROSS JOIN LATERAL (
+                SELECT COALESCE(t.seq, 0) AS seq, COALESCE(t.balance, u.energy, 0) AS balance
+            ) cur
+            WHERE u.id = '{safe_user_id}' AND ({condition})
+            ON CONFLICT DO NOTHING
+            RETURNING seq, balance
+    """
+
+
+def apply(cur, user_id, amount: int, reason: str, reference: Optional[str] = None) -> Optional[int]:
+    '''
+    Начисление (amount > 0) или списание без проверки баланса. Возвращает новый баланс;
+    None — пользователя нет. Если операция с таким reference уже проведена, возвращает текущий баланс
+    без повторного начисления. Каждая попытка — один запрос.
+    '''
+    safe_user_id = _escape(user_id)
+    reference_filter = 'FALSE'
+    if reference is not None:
+        reference_filter = f"""EXISTS (
+            SELECT 1 FROM energy_transactions
+            WHERE reason = '{_escape(reason)}' AND reference = '{_escape(reference)}'
+        )"""
+
+    for _ in range(MAX_ATTEMPTS):
+        cur.execute(f"""
+            WITH appended AS ({append_sql(user_id, amount, reason, reference)})
+            SELECT (SELECT balance FROM appended), u.id IS NOT NULL, {reference_filter},
+                   {balance_sql('u.id', 'u.energy')}
+            FROM (SELECT 1) AS one
+            LEFT JOIN users u ON u.id = '{safe_user_id}'
+        """)
+        new_balance, found, duplicate, current_balance = cur.fetchone()
+        if new_balance is not None:
+            return new_balance
+        if not found:
+            return None
+        if duplicate:
+            return current_balance
+    raise EnergyConflict(f'energy operation for user {user_id} kept conflicting')
+
+
+def history(cur, user_id: int, limit: int, before_seq: Optional[int] = None) -> list:
+    '''Операции пользователя от новых к старым, keyset по (user_id, seq)'''
+    before_filter = f'AND seq < {int(before_seq)}' if before_seq is not None else ''
+    cur.execute(f"""
+        SELECT seq, amount, balance, reason, reference, created_at
+        FROM energy_transactions
+        WHERE user_id = {int(user_id)} {before_filter}
+        ORDER BY seq DESC
+        LIMIT {int(limit)}
+    """)
+    return [
+        {
+            'seq': row[0],
+            'amount': row[1],
+            'balance': row[2],
+            'reason': row[3],
+            'reference': row[4],
+            'created_at': row[5].isoformat() + 'Z' if row[5] else None
+        }
+        for row in cur.fetchall()
+    ]
+
+
+def compact(cur, older_than_days: int, batch: int) -> int:
+    '''
+    Удаляет пачку старых списаний за сообщения — основной объём журнала. Последняя строка пользователя
+    (снимок баланса) не удаляется никогда, начисления и платежи хранятся всегда. Возвращает число строк.
+    '''
+    cur.execute(f"""
+        DELETE FROM energy_transactions
+        WHERE id IN (
+            SELECT t.id FROM energy_transactions t
+            WHERE t.reason = 'message'
+              AND t.created_at < CURRENT_TIMESTAMP - interval '{int(older_than_days)} days'
+              AND t.seq < (SELECT MAX(l.seq) FROM energy_transactions l WHERE l.user_id = t.user_id)
+            LIMIT {int(batch)}
+        )
+    """)
+    return cur.rowcount
@@ -0,0 +1,100 @@
+'''
+Business: События между процессами через Postgres LISTEN/NOTIFY
+Args: notify() вызывается внутри транзакции функции; Listener слушает каналы в отдельном потоке
+Returns: подписчики получают (channel, payload) только после COMMIT транзакции, в которой был notify
+'''
+
+import json
+import select
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from shared.db import get_dsn
+
+# Новые сообщения общего чата (payload в формате get-messages + координаты автора)
+CHAT_MESSAGES_CHANNEL = 'chat_messages'
+# События личных сообщений для WebSocket: {'deliveries': [{'userIds': [...], 'event': {...}}]}
+PRIVATE_EVENTS_CHANNEL = 'private_events'
+# Изменения уже опубликованных сообщений и их авторов для горячего окна (shared.hot_window):
+# {'type': 'reaction' | 'location' | 'avatar' | 'purge', ...}
+FEED_EVENTS_CHANNEL = 'feed_events'
+# Изменения чёрного списка для кэша блокировок (shared.blocklist): {'userId', 'blockedUserId'}
+BLOCKLIST_CHANNEL = 'blocklist_events'
+# Пульсы онлайн-статуса для реестра присутствия (shared.presence): {'userId', 'seenAt'}
+PRESENCE_CHANNEL = 'presence_events'
+# Postgres ограничивает payload NOTIFY 8000 байтами
+NOTIFY_MAX_BYTES = 7900
+
+
+def notify(cur, channel: str, payload: Dict[str, Any]) -> None:
+    '''pg_notify в текущей транзакции: при ROLLBACK событие не уйдёт. Лимит payload — 8000 байт'''
+    cur.execute('SELECT pg_notify(%s, %s)', (channel, json.dumps(payload)))
+
+
+def notify_users(cur, deliveries: list) -> None:
+    '''Адресные события пользователям: каждая доставка — {'userIds': [id, ...], 'event': {...}}'''
+    notify(cur, PRIVATE_EVENTS_CHANNEL, {'deliveries': deliveries})
+
+
+class Listener(threading.Thread):
+    '''
+    Держит отдельное (не из пула) соединение с LISTEN на каналы и вызывает callback(channel, payload)
+    на каждое уведомление. При обрыве соединения переподключается.
+    '''
+
+    def __init__(self, channels: Iterable[str], callback: Callable[[str, Any], None], dsn: Optional[str] = None):
+        super().__init__(name='pg-listener', daemon=True)
+        self.channels = list(channels)
+        self.callback = callback
+        self.dsn = dsn or get_dsn()
+        self._stop_event = threading.Event()
+        # Вызывается после каждого (пере)подключения: слушатель мог пропустить события, пока был отключён
+        self.on_connect: Optional[Callable[[], None]] = None
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    for channel in self.channels:
+                        cur.execute(f'LISTEN "{channel}"')
+                print(f'[pg-listener] listening on {", ".join(self.channels)}')
+                backoff = 1.0
+                if self.on_connect:
+                    self.on_connect()
+                self._loop(conn)
+            except Exception as e:
+                print(f'[pg-listener] connection lost: {e}, retry in {backoff:.0f}s')
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _loop(self, conn) -> None:
+        while not self._stop_event.is_set():
+            if select.select([conn], [], [], 5.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                note = conn.notifies.pop(0)
+                try:
+                    payload = json.loads(note.payload) if note.payload else None
+                except ValueError:
+                    payload = note.payload
+                try:
+                    self.callback(note.channel, payload)
+                except Exception as e:
+                    print(f'[pg-listener] callback failed for {note.channel}: {e}')
@@ -0,0 +1,124 @@
+'''
+Business: Геометрия для фильтрации по радиусу — гаверсинус и ограничивающий прямоугольник
+Args: координаты в градусах, радиус в км
+Returns: расстояния в км (по одной точке или пачкой через NumPy) и SQL-условие,
+         которое может использовать индекс users(latitude, longitude)
+'''
+
+from math import radians, degrees, cos, sin, asin, sqrt
+from typing import Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> float:
+    '''Расстояние между двумя точками в км; без координат — бесконечность'''
+    if None in (lat1, lon1, lat2, lon2):
+        return float('inf')
+
+    lat1, lon1, lat2, lon2 = radians(float(lat1)), radians(float(lon1)), radians(float(lat2)), radians(float(lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def distances_km(lat: float, lon: float, lats, lons) -> np.ndarray:
+    '''
+    Гаверсинус от одной точки до массивов координат за один проход NumPy.
+    None/NaN в lats/lons (нет координат) дают бесконечность, как в haversine_km.
+    '''
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    lat1, lon1 = radians(float(lat)), radians(float(lon))
+
+    lat2 = np.radians(lats)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * np.cos(lat2) * np.sin((np.radians(lons) - lon1) / 2) ** 2
+    distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    distances[np.isnan(distances)] = np.inf
+    return distances
+
+
+def within_radius(lat: float, lon: float, lats, lons, radius_km: float) -> np.ndarray:
+    '''
+    Булева маска точек не дальше radius_km от (lat, lon). Сначала сравнение с bounding_box —
+    без тригонометрии, точный гаверсинус только для точек, попавших в прямоугольник.
+    '''
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    lat_min, lat_max, lon_min, lon_max = bounding_box(lat, lon, radius_km)
+
+    candidates = (lats >= lat_min) & (lats <= lat_max)
+    if lon_min is not None:
+        candidates &= (lons >= lon_min) & (lons <= lon_max)
+
+    mask = np.zeros(lats.shape, dtype=bool)
+    idx = np.flatnonzero(candidates)
+    if idx.size:
+        mask[idx] = distances_km(lat, lon, lats[idx], lons[idx]) <= radius_km
+    return mask
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, Optional[float], Optional[float]]:
+    '''
+    Прямоугольник (lat_min, lat_max, lon_min, lon_max), гарантированно содержащий круг радиуса radius_km.
+    Если круг задевает полюс или линию перемены дат, долгота не ограничивается (lon_min/lon_max = None).
+    '''
+    lat, lon = float(lat), float(lon)
+    dlat = degrees(radius_km / EARTH_RADIUS_KM)
+    lat_min, lat_max = lat - dlat, lat + dlat
+    if lat_min <= -90 or lat_max >= 90:
+        return max(lat_min, -90.0), min(lat_max, 90.0), None, None
+
+    dlon = degrees(asin(min(1.0, sin(radius_km / EARTH_RADIUS_KM) / cos(radians(lat)))))
+    lon_min, lon_max = lon - dlon, lon + dlon
+    if lon_min < -180 or lon_max > 180:
+        return lat_min, lat_max, None, None
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def distance_sql(lat_col: str, lon_col: str, lat, lon) -> str:
+    '''SQL-выражение гаверсинуса в км от (lat, lon) — чисел или SQL-выражений — до (lat_col, lon_col)'''
+    return (
+        f"2 * {EARTH_RADIUS_KM} * asin(least(1.0, sqrt("
+        f"power(sin(radians({lat_col}::float8 - {lat}) / 2), 2) + "
+        f"cos(radians({lat})) * cos(radians({lat_col}::float8)) * "
+        f"power(sin(radians({lon_col}::float8 - {lon}) / 2), 2)"
+        f")))"
+    )
+
+
+def radius_sql(lat_col: str, lon_col: str, lat: float, lon: float, radius_km: float) -> str:
+    '''
+    SQL-условие "точка (lat_col, lon_col) в пределах radius_km от (lat, lon)".
+    Сначала грубый BETWEEN по прямоугольнику (идёт по btree индексу), затем точный гаверсинус.
+    '''
+    lat, lon, radius_km = float(lat), float(lon), float(radius_km)
+    lat_min, lat_max, lon_min, lon_max = bounding_box(lat, lon, radius_km)
+
+    conditions = [f"{lat_col} BETWEEN {lat_min} AND {lat_max}"]
+    if lon_min is not None:
+        conditions.append(f"{lon_col} BETWEEN {lon_min} AND {lon_max}")
+    conditions.append(f"{distance_sql(lat_col, lon_col, lat, lon)} <= {radius_km}")
+    return ' AND '.join(conditions)
+
+
+def radius_sql_from(lat_col: str, lon_col: str, lat_expr: str, lon_expr: str, radius_km: float) -> str:
+    '''
+    То же, что radius_sql, но центр круга — SQL-выражения (например, подзапрос координат пользователя),
+    чтобы не ходить за ними в БД отдельным запросом. Прямоугольник считается в самом SQL; границы
+    приводятся к numeric, иначе Postgres сравнит колонку как float8 и не возьмёт индекс.
+    '''
+    radius_km = float(radius_km)
+    dlat = degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = (
+        f"degrees(asin(least(1.0, {sin(radius_km / EARTH_RADIUS_KM)} / "
+        f"greatest(cos(radians({lat_expr})), 1e-9))))"
+    )
+    return ' AND '.join([
+        f"{lat_col} BETWEEN ({lat_expr} - {dlat})::numeric AND ({lat_expr} + {dlat})::numeric",
+        # У полюса и линии перемены дат долгота не ограничивается — как в bounding_box
+        f"(abs({lat_expr}) + {dlat} >= 90 OR abs({lon_expr}) + {dlon} > 180 OR "
+        f"{lon_col} BETWEEN ({lon_expr} - {dlon})::numeric AND ({lon_expr} + {dlon})::numeric)",
+        f"{distance_sql(lat_col, lon_col, lat_expr, lon_expr)} <= {radius_km}",
+    ])
@@ -0,0 +1,107 @@
+'''
+Business: Group commit — запросы, пришедшие за несколько миллисекунд, пишутся одной транзакцией
+Args: flush(items) -> results той же длины (результат или исключение на каждый элемент);
+      window_ms — сколько первый запрос пачки ждёт остальных, max_batch — после него пачка не ждёт окна
+Returns: submit(item) блокирует поток-обработчик до записи пачки и возвращает его собственный результат
+'''
+
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+
+# Включённые group commit процесса по имени функции — для /_stats
+_instances: Dict[str, 'GroupCommit'] = {}
+
+
+class _Slot:
+    __slots__ = ('item', 'result', 'done')
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.result = None
+        self.done = threading.Event()
+
+
+class GroupCommit:
+    '''
+    Отдельного потока нет: первый вызов submit() в пустой пачке становится ведущим — ждёт окно
+    (или заполнения пачки) и очереди на запись, забирает всё накопленное и вызывает flush() в своём
+    потоке. Остальные вызовы только ждут свой результат.
+    '''
+
+    def __init__(self, name: str, flush: Callable[[List[Any]], List[Any]], window_ms: float, max_batch: int):
+        self.name = name
+        self.flush = flush
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._cond = threading.Condition()
+        self._pending: List[_Slot] = []
+        self._flushing = threading.Lock()
+        self._stats = {'batches': 0, 'items': 0, 'max_batch': 0, 'full_batches': 0, 'flush_ms': 0.0}
+        _instances[name] = self
+
+    def submit(self, item: Any) -> Any:
+        slot = _Slot(item)
+        with self._cond:
+            self._pending.append(slot)
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+
+        if leader:
+            batch = None
+            try:
+                with self._cond:
+                    self._cond.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.window)
+                # Пачки пишутся по одной: пока пишется предыдущая, текущая продолжает набираться.
+                # Две пачки одного процесса не спорят за строки (seq журнала энергии) друг с другом
+                with self._flushing:
+                    with self._cond:
+                        batch, self._pending = self._pending, []
+                    self._run(batch)
+            finally:
+                # Ведущий прерван не-Exception (KeyboardInterrupt, SystemExit): ведомые не должны ждать вечно
+                if batch is None:
+                    with self._cond:
+                        batch, self._pending = self._pending, []
+                interrupted = RuntimeError(f'group commit {self.name}: leader interrupted')
+                for pending in batch:
+                    if not pending.done.is_set():
+                        pending.result = interrupted
+                        pending.done.set()
+        slot.done.wait()
+        if isinstance(slot.result, BaseException):
+            raise slot.result
+        return slot.result
+
+    def _run(self, batch: List[_Slot]) -> None:
+        started = time.perf_counter()
+        try:
+            results = self.flush([slot.item for slot in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f'flush returned {len(results)} results for {len(batch)} items')
+        except Exception as e:
+            results = [e] * len(batch)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._cond:
+            self._stats['batches'] += 1
+            self._stats['items'] += len(batch)
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+            self._stats['full_batches'] += len(batch) >= self.max_batch
+            self._stats['flush_ms'] += elapsed_ms
+        for slot, result in zip(batch, results):
+            slot.result = result
+            slot.done.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+        stats['window_ms'] = self.window * 1000
+        stats['avg_batch'] = round(stats['items'] / stats['batches'], 2) if stats['batches'] else 0
+        stats['flush_ms'] = round(stats['flush_ms'], 1)
+        return stats
+
+
+def all_stats() -> dict:
+    return {name: instance.stats() for name, instance in _instances.items()}
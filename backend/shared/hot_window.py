@@ -0,0 +1,258 @@
+'''
+Business: Горячее окно общего чата — последние N сообщений с авторами и реакциями в памяти процесса
+Args: наполняется load() при (пере)подключении pg-listener, дальше — событиями send-message/add-reaction
+      (запись в своём процессе + NOTIFY остальным) и FEED_EVENTS_CHANNEL
+Returns: первая страница get-messages без запроса в БД; в БД уходит только холодная пагинация
+'''
+
+import os
+import threading
+from bisect import insort
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from shared.avatars import fallback_avatar
+from shared.geo import within_radius
+
+HOT_WINDOW_SIZE = int(os.environ.get('HOT_WINDOW_SIZE', '500'))
+# Координаты читателей ленты (LRU), чтобы фильтр по радиусу не ходил в БД
+HOT_WINDOW_LOCATIONS = int(os.environ.get('HOT_WINDOW_LOCATIONS', '50000'))
+
+# Координаты ещё не известны окну (в отличие от None — "у пользователя нет координат")
+UNKNOWN = object()
+
+
+def _parse_time(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.rstrip('Z'))
+
+
+class HotWindow:
+    '''
+    Сообщения упорядочены по (created_at, id), как индекс ленты. Все операции идемпотентны:
+    своё событие приходит и напрямую из обработчика, и через LISTEN. Счётчики реакций
+    применяются только если их версия (messages.reactions_updated_at) новее уже известной.
+    '''
+
+    def __init__(self, size: int = HOT_WINDOW_SIZE, locations_size: int = HOT_WINDOW_LOCATIONS):
+        self.size = size
+        self.locations_size = locations_size
+        self.ready = False
+        self._lock = threading.Lock()
+        self._keys: List[Tuple[datetime, int]] = []
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._locations: Dict[int, Tuple[Optional[float], Optional[float]]] = {}
+        # Окно содержит всю таблицу messages — страница короче limit тогда тоже ответ
+        self._complete = False
+        # (id от новых к старым, широты, долготы авторов) для фильтра по радиусу пачкой; None — пересчитать
+        self._coords = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, cur) -> None:
+        '''Перечитывает окно из БД: при старте и после переподключения слушателя (события могли потеряться)'''
+        # Пока окно не перечитано, оно может быть неактуальным — лента идёт в БД
+        self.ready = False
+        cur.execute(f"""
+            SELECT m.id, m.text, m.created_at, u.id, u.username, u.main_photo_url,
+                   u.latitude, u.longitude, m.reactions_updated_at,
+                   (SELECT json_object_agg(c.emoji, c.count)
+                    FROM message_reaction_counts c
+                    WHERE c.message_id = m.id AND c.count > 0)
+            FROM messages m
+            JOIN users u ON m.user_id = u.id
+            ORDER BY m.created_at DESC, m.id DESC
+            LIMIT {int(self.size)}
+        """)
+        rows = cur.fetchall()
+
+        entries = {}
+        for row in rows:
+            msg_id, text, created_at, user_id, username, main_photo_url, lat, lon, reactions_version, counts = row
+            entries[msg_id] = {
+                'id': msg_id,
+                'text': text,
+                'created_at': created_at,
+                'user': {'id': user_id, 'username': username, 'avatar': main_photo_url or fallback_avatar(username)},
+                'latitude': float(lat) if lat is not None else None,
+                'longitude': float(lon) if lon is not None else None,
+                'reactions': counts or {},
+                'reactions_version': reactions_version,
+                'versions': {},
+            }
+
+        with self._lock:
+            self._entries = entries
+            self._keys = sorted((entry['created_at'], msg_id) for msg_id, entry in entries.items())
+            self._complete = len(rows) < self.size
+            self._coords = None
+            self.ready = True
+
+    def add_message(self, payload: Dict[str, Any]) -> None:
+        '''payload события CHAT_MESSAGES_CHANNEL: {'message': {...формат get-messages}, 'latitude', 'longitude'}'''
+        message = payload['message']
+        created_at = _parse_time(message['created_at'])
+        with self._lock:
+            if not self.ready or message['id'] in self._entries:
+                return
+            key = (created_at, message['id'])
+            if len(self._keys) >= self.size:
+                if key < self._keys[0]:
+                    return
+                _, oldest_id = self._keys.pop(0)
+                del self._entries[oldest_id]
+                self._complete = False
+            insort(self._keys, key)
+            self._coords = None
+            self._entries[message['id']] = {
+                'id': message['id'],
+                'text': message['text'],
+                'created_at': created_at,
+                'user': dict(message['user']),
+                'latitude': payload.get('latitude'),
+                'longitude': payload.get('longitude'),
+                'reactions': {r['emoji']: r['count'] for r in message.get('reactions', [])},
+                'reactions_version': None,
+                'versions': {},
+            }
+
+    def set_reaction(self, message_id: int, emoji: str, count: int, version) -> None:
+        # version NULL — строки сообщения уже нет (удалено или чужой id): менять нечего
+        if version is None:
+            return
+        version = _parse_time(version)
+        with self._lock:
+            entry = self._entries.get(message_id)
+            if entry is None:
+                return
+            known = entry['versions'].get(emoji) or entry['reactions_version']
+            if known is not None and version <= known:
+                return
+            entry['versions'][emoji] = version
+            if count > 0:
+                entry['reactions'][emoji] = count
+            else:
+                entry['reactions'].pop(emoji, None)
+
+    def set_location(self, user_id: int, latitude, longitude) -> None:
+        latitude = float(latitude) if latitude is not None else None
+        longitude = float(longitude) if longitude is not None else None
+        with self._lock:
+            self._locations.pop(user_id, None)
+            self._locations[user_id] = (latitude, longitude)
+            if len(self._locations) > self.locations_size:
+                del self._locations[next(iter(self._locations))]
+            for entry in self._entries.values():
+                if entry['user']['id'] == user_id:
+                    entry['latitude'], entry['longitude'] = latitude, longitude
+                    self._coords = None
+
+    def location(self, user_id: int):
+        '''(latitude, longitude) читателя или UNKNOWN, если окно его ещё не видело'''
+        with self._lock:
+            location = self._locations.pop(user_id, UNKNOWN)
+            if location is not UNKNOWN:
+                self._locations[user_id] = location
+            return location
+
+    def set_avatar(self, user_id: int, avatar: str) -> None:
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['user']['id'] == user_id:
+                    entry['user']['avatar'] = avatar
+
+    def purge_user(self, user_id: int) -> None:
+        '''Сообщения удалённого пользователя (admin-users delete)'''
+        with self._lock:
+            self._locations.pop(user_id, None)
+            removed = [msg_id for msg_id, entry in self._entries.items() if entry['user']['id'] == user_id]
+            for msg_id in removed:
+                del self._entries[msg_id]
+            if removed:
+                self._keys = [key for key in self._keys if key[1] in self._entries]
+                self._coords = None
+
+    def apply(self, payload: Dict[str, Any]) -> None:
+        '''Событие FEED_EVENTS_CHANNEL'''
+        kind = payload.get('type')
+        if kind == 'reaction':
+            self.set_reaction(payload['messageId'], payload['emoji'], payload['count'], payload['version'])
+        elif kind == 'location':
+            self.set_location(payload['userId'], payload['latitude'], payload['longitude'])
+        elif kind == 'avatar':
+            self.set_avatar(payload['userId'], payload['avatar'])
+        elif kind == 'purge':
+            self.purge_user(payload['userId'])
+
+    def first_page(self, limit: int, origin: Optional[Tuple[float, float]], radius_km: float,
+                   exclude: FrozenSet[int] = frozenset()) -> Optional[list]:
+        '''
+        Последние limit сообщений (от старых к новым) в радиусе от origin, кроме авторов из exclude
+        (блокировки читателя), или None, если окно не может ответить: не загружено либо в нём не набралось
+        limit подходящих сообщений, а в БД есть старше. Возвращает пары (created_at, сообщение в формате get-messages).
+        '''
+        if limit <= 0:
+            return []
+        with self._lock:
+            if not self.ready:
+                self.misses += 1
+                return None
+            newest_first = reversed(self._keys)
+            if origin:
+                if self._coords is None:
+                    ids = [msg_id for _, msg_id in reversed(self._keys)]
+                    self._coords = (
+                        ids,
+                        np.array([self._entries[msg_id]['latitude'] for msg_id in ids], dtype=np.float64),
+                        np.array([self._entries[msg_id]['longitude'] for msg_id in ids], dtype=np.float64),
+                    )
+                ids, lats, lons = self._coords
+                mask = within_radius(origin[0], origin[1], lats, lons, radius_km)
+                matched = mask.nonzero()[0]
+                # Без исключений дальше limit подходящих смотреть незачем
+                if not exclude:
+                    matched = matched[:limit]
+                newest_first = [(self._entries[ids[i]]['created_at'], ids[i]) for i in matched]
+            page = []
+            for created_at, msg_id in newest_first:
+                entry = self._entries[msg_id]
+                if entry['user']['id'] in exclude:
+                    continue
+                page.append((created_at, {
+                    'id': msg_id,
+                    'text': entry['text'],
+                    'created_at': created_at.isoformat() + 'Z',
+                    'user': dict(entry['user']),
+                    'reactions': [
+                        {'emoji': emoji, 'count': count} for emoji, count in sorted(entry['reactions'].items())
+                    ],
+                }))
+                if len(page) == limit:
+                    break
+            else:
+                if not self._complete:
+                    self.misses += 1
+                    return None
+            self.hits += 1
+        page.reverse()
+        return page
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'messages': len(self._entries),
+                'locations': len(self._locations),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_window = HotWindow()
+
+
+def get_window() -> HotWindow:
+    return _window
@@ -0,0 +1,190 @@
+'''
+Business: Пространственная сетка пользователей с координатами в памяти процесса — поиск "люди рядом"
+Args: наполняется load() при (пере)подключении pg-listener, дальше — событиями location/purge
+      из FEED_EVENTS_CHANNEL (update-location, admin-users)
+Returns: id ближайших пользователей с расстояниями за миллисекунды без сканирования таблицы users
+'''
+
+import os
+import threading
+from math import floor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from shared.geo import EARTH_RADIUS_KM, bounding_box, distances_km, within_radius
+
+# Размер ячейки сетки в градусах (0.5° — около 55 км по широте)
+NEARBY_CELL_DEG = float(os.environ.get('NEARBY_CELL_DEG', '0.5'))
+# Сколько перемещений копится поверх отсортированных массивов до их перестроения
+NEARBY_COMPACT_AFTER = int(os.environ.get('NEARBY_COMPACT_AFTER', '20000'))
+# Половина длины экватора — дальше искать некуда
+MAX_DISTANCE_KM = 20038.0
+
+_EMPTY_IDS = np.empty(0, dtype=np.int64)
+_EMPTY_COORDS = np.empty(0, dtype=np.float64)
+
+
+class UserGrid:
+    '''
+    Пользователи лежат в NumPy-массивах, отсортированных по номеру ячейки (строка широты * число
+    столбцов + столбец долготы), поэтому одна строка сетки в пределах прямоугольника — непрерывный
+    срез, который находится бинарным поиском. Перемещения после загрузки копятся в небольшом
+    словаре поверх массивов и периодически вливаются в них.
+    '''
+
+    def __init__(self, cell_deg: float = NEARBY_CELL_DEG, compact_after: int = NEARBY_COMPACT_AFTER):
+        self.cell_deg = cell_deg
+        self.compact_after = compact_after
+        self._cols = int(np.ceil(360.0 / cell_deg)) + 1
+        self.ready = False
+        self._lock = threading.Lock()
+        self._set_base(_EMPTY_IDS, _EMPTY_COORDS, _EMPTY_COORDS)
+        # user_id -> (latitude, longitude) или None, если пользователь удалён
+        self._overlay: Dict[int, Optional[Tuple[float, float]]] = {}
+        self._overlay_arrays = None
+
+    def _cell_keys(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        rows = np.floor((lats + 90.0) / self.cell_deg).astype(np.int64)
+        cols = np.floor((lons + 180.0) / self.cell_deg).astype(np.int64)
+        return rows * self._cols + cols
+
+    def _set_base(self, ids: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> None:
+        keys = self._cell_keys(lats, lons)
+        order = np.argsort(keys, kind='stable')
+        self._keys, self._ids, self._lats, self._lons = keys[order], ids[order], lats[order], lons[order]
+
+    def load(self, cur, batch_size: int = 50000) -> None:
+        '''Перечитывает координаты всех пользователей; named cursor, чтобы не держать в памяти миллион кортежей'''
+        self.ready = False
+        chunks = []
+        named = cur.connection.cursor(name='nearby_grid_load')
+        named.itersize = batch_size
+        named.execute("""
+            SELECT id, latitude, longitude FROM users
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """)
+        while True:
+            rows = named.fetchmany(batch_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+        named.close()
+        cur.connection.commit()
+
+        data = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.float64)
+        with self._lock:
+            self._set_base(data[:, 0].astype(np.int64), data[:, 1].copy(), data[:, 2].copy())
+            self._overlay = {}
+            self._overlay_arrays = None
+            self.ready = True
+
+    def set_location(self, user_id: int, latitude, longitude) -> None:
+        with self._lock:
+            self._overlay[int(user_id)] = (float(latitude), float(longitude))
+            self._overlay_arrays = None
+            if len(self._overlay) > self.compact_after:
+                self._compact()
+
+    def remove(self, user_id: int) -> None:
+        with self._lock:
+            self._overlay[int(user_id)] = None
+            self._overlay_arrays = None
+
+    def apply(self, payload) -> None:
+        '''Событие FEED_EVENTS_CHANNEL'''
+        kind = payload.get('type')
+        if kind == 'location' and payload.get('latitude') is not None and payload.get('longitude') is not None:
+            self.set_location(payload['userId'], payload['latitude'], payload['longitude'])
+        elif kind == 'purge':
+            self.remove(payload['userId'])
+
+    def _overlay_view(self):
+        '''(id всех перемещённых/удалённых, id/широты/долготы актуальных) — кэш до следующего изменения'''
+        if self._overlay_arrays is None:
+            moved = np.fromiter(self._overlay.keys(), dtype=np.int64, count=len(self._overlay))
+            live = [(user_id, point) for user_id, point in self._overlay.items() if point is not None]
+            self._overlay_arrays = (
+                moved,
+                np.array([user_id for user_id, _ in live], dtype=np.int64),
+                np.array([point[0] for _, point in live], dtype=np.float64),
+                np.array([point[1] for _, point in live], dtype=np.float64),
+            )
+        return self._overlay_arrays
+
+    def _compact(self) -> None:
+        moved, ids, lats, lons = self._overlay_view()
+        keep = ~np.isin(self._ids, moved)
+        self._set_base(
+            np.concatenate([self._ids[keep], ids]),
+            np.concatenate([self._lats[keep], lats]),
+            np.concatenate([self._lons[keep], lons]),
+        )
+        self._overlay = {}
+        self._overlay_arrays = None
+
+    def _candidates(self, lat: float, lon: float, radius_km: float):
+        '''Пользователи из ячеек, пересекающих прямоугольник вокруг круга (с запасом)'''
+        lat_min, lat_max, lon_min, lon_max = bounding_box(lat, lon, radius_km)
+        if lon_min is None:
+            lon_min, lon_max = -180.0, 180.0
+        row_min = floor((lat_min + 90.0) / self.cell_deg)
+        row_max = floor((lat_max + 90.0) / self.cell_deg)
+        col_min = floor((lon_min + 180.0) / self.cell_deg)
+        col_max = floor((lon_max + 180.0) / self.cell_deg)
+
+        slices = []
+        for row in range(row_min, row_max + 1):
+            start = np.searchsorted(self._keys, row * self._cols + col_min, side='left')
+            end = np.searchsorted(self._keys, row * self._cols + col_max, side='right')
+            if end > start:
+                slices.append(np.arange(start, end))
+        idx = np.concatenate(slices) if slices else _EMPTY_IDS
+        ids, lats, lons = self._ids[idx], self._lats[idx], self._lons[idx]
+
+        if self._overlay:
+            moved, overlay_ids, overlay_lats, overlay_lons = self._overlay_view()
+            keep = ~np.isin(ids, moved)
+            ids = np.concatenate([ids[keep], overlay_ids])
+            lats = np.concatenate([lats[keep], overlay_lats])
+            lons = np.concatenate([lons[keep], overlay_lons])
+        return ids, lats, lons
+
+    def _within(self, lat: float, lon: float, radius_km: float, exclude: Optional[int]):
+        ids, lats, lons = self._candidates(lat, lon, radius_km)
+        mask = within_radius(lat, lon, lats, lons, radius_km)
+        if exclude is not None:
+            mask &= ids != exclude
+        ids = ids[mask]
+        distances = distances_km(lat, lon, lats[mask], lons[mask])
+        order = np.argsort(distances, kind='stable')
+        return ids[order], distances[order]
+
+    def nearest(self, lat: float, lon: float, k: int, max_radius_km: Optional[float] = None,
+                exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        '''
+        k ближайших (id, км) по возрастанию расстояния, не дальше max_radius_km, если задан.
+        Без радиуса поиск расширяется кольцами: если в круге набралось k точек, ближе них вне круга нет.
+        '''
+        with self._lock:
+            if max_radius_km is not None:
+                ids, distances = self._within(lat, lon, max_radius_km, exclude)
+            else:
+                radius_km = self.cell_deg * EARTH_RADIUS_KM * np.pi / 180.0
+                while True:
+                    ids, distances = self._within(lat, lon, radius_km, exclude)
+                    if len(ids) >= k or radius_km >= MAX_DISTANCE_KM:
+                        break
+                    radius_km = min(radius_km * 4, MAX_DISTANCE_KM)
+        return [(int(user_id), float(distance)) for user_id, distance in zip(ids[:k], distances[:k])]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'ready': self.ready, 'users': int(len(self._ids)), 'pending_moves': len(self._overlay)}
+
+
+_grid = UserGrid()
+
+
+def get_grid() -> UserGrid:
+    return _grid
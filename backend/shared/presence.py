@@ -0,0 +1,159 @@
+'''
+Business: Онлайн-статус пользователей в памяти процесса вместо UPDATE users.last_activity на каждый пульс
+Args: heartbeat() из update-activity, send-message, private-messages; события PRESENCE_CHANNEL от других процессов;
+      load() при (пере)подключении pg-listener
+Returns: online/offline пачкой для списков пользователей; users.last_activity догоняется через буфер
+         write-behind раз в PRESENCE_FLUSH_SECONDS
+'''
+
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from shared.events import PRESENCE_CHANNEL, notify
+from shared.write_behind import WriteBehind, enabled as write_behind_enabled
+
+# Онлайн — был активен не дольше PRESENCE_TTL_SECONDS назад
+PRESENCE_TTL_SECONDS = int(os.environ.get('PRESENCE_TTL_SECONDS', '300'))
+# Как часто один процесс рассылает пульс пользователя остальным: клиенты шлют его раз в минуту,
+# и другим процессам достаточно знать время с точностью, много меньшей TTL
+PRESENCE_BROADCAST_SECONDS = int(os.environ.get('PRESENCE_BROADCAST_SECONDS', '100'))
+# Как часто накопленные пульсы записываются в users.last_activity
+PRESENCE_FLUSH_SECONDS = int(os.environ.get('PRESENCE_FLUSH_SECONDS', '60'))
+
+# Пульсы этого процесса для users.last_activity: на пользователя — только последний, время только растёт
+activity_writes = WriteBehind(
+    'last_activity', 'users', 'id', {'last_activity': 'timestamp'},
+    interval_ms=PRESENCE_FLUSH_SECONDS * 1000, max_entries=1000,
+    condition='t.last_activity IS NULL OR t.last_activity < v.last_activity',
+)
+
+
+def _parse_time(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.rstrip('Z'))
+
+
+class PresenceRegistry:
+    '''
+    Время последнего пульса (UTC, как users.last_activity) по всем процессам. Свои пульсы процесс
+    рассылает через NOTIFY не чаще PRESENCE_BROADCAST_SECONDS на пользователя и отдаёт в activity_writes.
+    Пока registry не загружен (нет pg-listener) или буфер выключен, heartbeat() пишет в users напрямую, как раньше.
+    '''
+
+    def __init__(self, ttl_seconds: int = PRESENCE_TTL_SECONDS, broadcast_seconds: int = PRESENCE_BROADCAST_SECONDS):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.broadcast_interval = timedelta(seconds=broadcast_seconds)
+        self.ready = False
+        self._lock = threading.Lock()
+        self._seen: Dict[int, datetime] = {}
+        self._broadcast: Dict[int, datetime] = {}
+        self._expired_at = datetime.utcnow()
+        self._stats = {'heartbeats': 0, 'broadcasts': 0}
+
+    def load(self, cur) -> None:
+        '''Стартовое состояние из users.last_activity: кто был активен в пределах TTL'''
+        cur.execute(f"""
+            SELECT id, last_activity FROM users
+            WHERE last_activity > CURRENT_TIMESTAMP - interval '{int(self.ttl.total_seconds())} seconds'
+        """)
+        rows = cur.fetchall()
+        cur.connection.commit()
+        with self._lock:
+            for user_id, last_activity in rows:
+                if last_activity > self._seen.get(user_id, datetime.min):
+                    self._seen[user_id] = last_activity
+            self.ready = True
+
+    def _touch(self, user_id: int, seen_at: datetime) -> None:
+        if seen_at > self._seen.get(user_id, datetime.min):
+            self._seen[user_id] = seen_at
+        # Раз в TTL забываем тех, кто давно офлайн: их статус и так вычисляется как offline
+        if seen_at - self._expired_at > self.ttl:
+            threshold = seen_at - self.ttl
+            for expired_id in [expired_id for expired_id, seen in self._seen.items() if seen <= threshold]:
+                del self._seen[expired_id]
+                self._broadcast.pop(expired_id, None)
+            self._expired_at = seen_at
+
+    def record(self, user_id: int) -> bool:
+        '''
+        Пульс только в памяти, без БД. False — ничего не записано и нужен heartbeat() с курсором:
+        registry не загружен или этот пульс пора разослать другим процессам
+        '''
+        user_id = int(user_id)
+        # Всё, из-за чего пульс уйдёт в heartbeat(), проверяется до put(): каждый пульс попадает в буфер один раз
+        if not self.ready or not write_behind_enabled():
+            return False
+        now = datetime.utcnow()
+        with self._lock:
+            last_broadcast = self._broadcast.get(user_id)
+            if last_broadcast is None or now - last_broadcast >= self.broadcast_interval:
+                return False
+        if not activity_writes.put(user_id, {'last_activity': now}):
+            # Буфер выключился между проверкой и записью (остановка сервера); put() ничего не учёл
+            return False
+        with self._lock:
+            self._stats['heartbeats'] += 1
+            self._touch(user_id, now)
+        return True
+
+    def heartbeat(self, cur, user_id: int) -> None:
+        '''
+        Пульс в транзакции вызывающей функции: NOTIFY (раз в PRESENCE_BROADCAST_SECONDS на пользователя)
+        уйдёт после её COMMIT. Пока registry не загружен — прежний UPDATE users
+        '''
+        user_id = int(user_id)
+        now = datetime.utcnow()
+        if not self.ready or not activity_writes.put(user_id, {'last_activity': now}):
+            cur.execute(f"UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE id = {user_id}")
+            if not self.ready:
+                return
+        with self._lock:
+            self._stats['heartbeats'] += 1
+            self._touch(user_id, now)
+            last_broadcast = self._broadcast.get(user_id)
+            due = last_broadcast is None or now - last_broadcast >= self.broadcast_interval
+            if due:
+                self._broadcast[user_id] = now
+                self._stats['broadcasts'] += 1
+        if due:
+            notify(cur, PRESENCE_CHANNEL, {'userId': user_id, 'seenAt': now.isoformat()})
+
+    def apply(self, payload) -> None:
+        '''Событие PRESENCE_CHANNEL (в том числе своё)'''
+        with self._lock:
+            self._touch(int(payload['userId']), _parse_time(payload['seenAt']))
+
+    def statuses(self, last_activity_by_user: Dict[int, Optional[datetime]]) -> Dict[int, str]:
+        '''
+        'online'/'offline' пачкой под одной блокировкой. Значения словаря — users.last_activity из уже
+        сделанного запроса (может быть None): он нужен, пока registry не загружен
+        '''
+        threshold = datetime.utcnow() - self.ttl
+        result = {}
+        with self._lock:
+            for user_id, last_activity in last_activity_by_user.items():
+                seen = self._seen.get(int(user_id))
+                if last_activity is not None and (seen is None or last_activity > seen):
+                    seen = last_activity
+                result[user_id] = 'online' if seen is not None and seen > threshold else 'offline'
+        return result
+
+    def status(self, user_id: int, last_activity: Optional[datetime] = None) -> str:
+        return self.statuses({user_id: last_activity})[user_id]
+
+    def stats(self) -> dict:
+        threshold = datetime.utcnow() - self.ttl
+        with self._lock:
+            online = sum(1 for seen in self._seen.values() if seen > threshold)
+            return {'ready': self.ready, 'online': online, **self._stats}
+
+
+_registry = PresenceRegistry()
+
+
+def get_presence() -> PresenceRegistry:
+    return _registry
@@ -0,0 +1,149 @@
+'''
+Business: Реакции на сообщения — атомарный toggle со счётчиком message_reaction_counts и сверка счётчиков
+Args: курсор открытой транзакции
+Returns: действие и актуальный счётчик emoji, число затронутых пар (сообщение, emoji) или исправленных строк при сверке
+'''
+
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from shared.events import FEED_EVENTS_CHANNEL
+
+
+def _escape(value) -> str:
+    return str(value).replace("'", "''")
+
+
+def toggle(cur, message_id, user_id, emoji: str) -> Tuple[str, int, datetime]:
+    '''
+    Одним запросом снимает реакцию пользователя, а если её не было — ставит, обновляет счётчик
+    и reactions_updated_at сообщения и шлёт новый счётчик в FEED_EVENTS_CHANNEL.
+    Возвращает (action, новый счётчик emoji, версию — новое reactions_updated_at).
+    Гонку двойного тапа разрешает уникальный индекс (message_id, user_id, emoji): второй INSERT
+    ждёт первый и превращается в no-op, дубликатов и расхождения счётчика не бывает.
+    '''
+    safe_message_id, safe_user_id, safe_emoji = _escape(message_id), _escape(user_id), _escape(emoji)
+    cur.execute(f"""
+        WITH removed AS (
+            DELETE FROM message_reactions
+            WHERE message_id = '{safe_message_id}' AND user_id = '{safe_user_id}' AND emoji = '{safe_emoji}'
+            RETURNING 1
+        ),
+        added AS (
+            INSERT INTO message_reactions (message_id, user_id, emoji)
+            SELECT '{safe_message_id}', '{safe_user_id}', '{safe_emoji}'
+            WHERE NOT EXISTS (SELECT 1 FROM removed)
+            ON CONFLICT (message_id, user_id, emoji) DO NOTHING
+            RETURNING 1
+        ),
+        delta AS (
+            SELECT (SELECT COUNT(*) FROM added) - (SELECT COUNT(*) FROM removed) AS value
+        ),
+        counted AS (
+            INSERT INTO message_reaction_counts (message_id, emoji, count)
+            SELECT '{safe_message_id}', '{safe_emoji}', GREATEST(delta.value, 0) FROM delta
+            ON CONFLICT (message_id, emoji) DO UPDATE
+            SET count = GREATEST(message_reaction_counts.count + (SELECT value FROM delta), 0),
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING count
+        ),
+        touched AS (
+            -- Поллинг get-messages?since_id=... забирает счётчики только у сообщений с изменившимися реакциями
+            -- clock_timestamp() берётся под блокировкой строки сообщения, поэтому растёт в порядке коммитов
+            -- и служит версией счётчика для горячего окна
+            UPDATE messages SET reactions_updated_at = clock_timestamp()
+            WHERE id = '{safe_message_id}'
+            RETURNING reactions_updated_at
+        )
+        SELECT EXISTS (SELECT 1 FROM removed), (SELECT count FROM counted), (SELECT reactions_updated_at FROM touched),
+               pg_notify('{FEED_EVENTS_CHANNEL}', json_build_object(
+                   'type', 'reaction',
+                   'messageId', '{safe_message_id}'::int,
+                   'emoji', '{safe_emoji}'::text,
+                   'count', (SELECT count FROM counted),
+                   'version', (SELECT reactions_updated_at FROM touched)
+               )::text)
+    """)
+    was_removed, count, version, _ = cur.fetchone()
+    return ('removed' if was_removed else 'added'), count, version
+
+
+def remove_user(cur, user_id) -> int:
+    '''
+    Снимает все реакции пользователя (удаление аккаунта) в текущей транзакции: уменьшает счётчики
+    message_reaction_counts, сдвигает reactions_updated_at затронутых сообщений и шлёт новый счётчик
+    каждой пары (сообщение, emoji) в FEED_EVENTS_CHANNEL, как toggle. Возвращает число таких пар.
+    '''
+    cur.execute(f"""
+        WITH removed AS (
+            DELETE FROM message_reactions
+            WHERE user_id = '{_escape(user_id)}'
+            RETURNING message_id, emoji
+        ),
+        delta AS (
+            SELECT message_id, emoji, COUNT(*) AS value
+            FROM removed
+            WHERE message_id IS NOT NULL
+            GROUP BY message_id, emoji
+        ),
+        counted AS (
+            UPDATE message_reaction_counts c
+            SET count = GREATEST(c.count - d.value, 0), updated_at = CURRENT_TIMESTAMP
+            FROM delta d
+            WHERE c.message_id = d.message_id AND c.emoji = d.emoji
+            RETURNING c.message_id, c.emoji, c.count
+        ),
+        touched AS (
+            UPDATE messages SET reactions_updated_at = clock_timestamp()
+            WHERE id IN (SELECT message_id FROM delta)
+            RETURNING id, reactions_updated_at
+        ),
+        notified AS (
+            SELECT pg_notify('{FEED_EVENTS_CHANNEL}', json_build_object(
+                       'type', 'reaction',
+                       'messageId', c.message_id,
+                       'emoji', c.emoji,
+                       'count', c.count,
+                       'version', t.reactions_updated_at
+                   )::text)
+            FROM counted c
+            JOIN touched t ON t.id = c.message_id
+        )
+        SELECT COUNT(*) FROM notified
+    """)
+    return cur.fetchone()[0]
+
+
+def repair(cur, message_ids: Optional[Iterable[int]] = None) -> int:
+    '''
+    Пересчитывает счётчики из message_reactions (всё или только message_ids) и удаляет нулевые строки.
+    Берёт SHARE-блокировку message_reactions до конца транзакции, чтобы add-reaction не менял данные
+    во время пересчёта, — запускать пачками и не в пик.
+    '''
+    message_filter = ''
+    if message_ids is not None:
+        safe_ids = ','.join(str(int(mid)) for mid in message_ids)
+        if not safe_ids:
+            return 0
+        message_filter = f'AND message_id IN ({safe_ids})'
+
+    cur.execute('LOCK TABLE message_reactions IN SHARE MODE')
+    cur.execute(f"""
+        INSERT INTO message_reaction_counts (message_id, emoji, count)
+        SELECT message_id, emoji, COUNT(*)
+        FROM message_reactions
+        WHERE message_id IS NOT NULL {message_filter}
+        GROUP BY message_id, emoji
+        ON CONFLICT (message_id, emoji) DO UPDATE
+        SET count = EXCLUDED.count, updated_at = CURRENT_TIMESTAMP
+        WHERE message_reaction_counts.count <> EXCLUDED.count
+    """)
+    fixed = cur.rowcount
+    cur.execute(f"""
+        DELETE FROM message_reaction_counts c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM message_reactions r
+            WHERE r.message_id = c.message_id AND r.emoji = c.emoji
+        ) {message_filter.replace('message_id', 'c.message_id')}
+    """)
+    return fixed + cur.rowcount
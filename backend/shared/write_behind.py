@@ -0,0 +1,251 @@
+'''
+Business: Отложенная запись (write-behind) частых UPDATE одной таблицы — в буфере остаётся только последнее значение по ключу
+Args: put(key, values) из обработчиков; буфер пишется фоновым потоком раз в interval_ms или при max_entries ключей;
+      start_all()/stop_all() вызывает server.py при старте и остановке (stop_all дописывает остаток)
+Returns: один UPDATE ... FROM (VALUES ...) на пачку вместо connect + UPDATE + COMMIT на каждый вызов
+'''
+
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Буферы процесса по имени — для /_stats и остановки
+_instances: Dict[str, 'WriteBehind'] = {}
+# Буферы принимают записи, только пока их кто-то гарантированно допишет: server.py между start_all и stop_all.
+# Без сервера (одна функция на вызов) put() возвращает False и обработчик пишет сам, как раньше
+_enabled = False
+# Сколько сбросов подряд строка может не записаться поодиночке, прежде чем её выбросят
+MAX_ROW_ATTEMPTS = 3
+
+
+def _literal(value: Any) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        # В кавычках: тип задаёт приведение из columns, а nan/inf не превратятся в имя колонки
+        return "'" + repr(value) + "'"
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class WriteBehind:
+    '''
+    columns — {колонка: тип Postgres}: ими (и key_type для ключа) типизируются литералы VALUES. condition — дополнительное
+    условие WHERE над строкой таблицы t и новыми значениями v. notify_sql — выражение (обычно pg_notify)
+    над каждой обновлённой строкой u в той же транзакции. write_through_cold — буферизуются только частые
+    вызовы: первый за interval_ms по ключу пишется обработчиком сразу, и его результат виден следующему запросу.
+    '''
+
+    def __init__(self, name: str, table: str, key: str, columns: Dict[str, str], interval_ms: float,
+                 max_entries: int, condition: Optional[str] = None, notify_sql: Optional[str] = None,
+                 write_through_cold: bool = False, key_type: str = 'integer'):
+        self.name = name
+        self.table = table
+        self.key = key
+        self.key_type = key_type
+        self.columns = columns
+        self.interval = interval_ms / 1000.0
+        self.max_entries = max(1, max_entries)
+        self.condition = condition
+        self.notify_sql = notify_sql
+        self.write_through_cold = write_through_cold
+        self._lock = threading.Lock()
+        self._pending: Dict[Any, Dict[str, Any]] = {}
+        # Время последнего put() по ключу — для write_through_cold
+        self._recent: Dict[Any, float] = {}
+        # Неудачные поодиночные записи по ключу подряд
+        self._attempts: Dict[Any, int] = {}
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            'writes': 0, 'written_through': 0, 'coalesced': 0, 'batches': 0, 'rows': 0, 'failures': 0, 'dropped': 0,
+            'flush_ms': 0.0,
+        }
+        _instances[name] = self
+
+    def put(self, key: Any, values: Dict[str, Any]) -> bool:
+        '''Запоминает новое значение ключа поверх прежнего; False — буфер выключен или ключ холодный, писать нужно самому'''
+        if not _enabled:
+            return False
+        with self._lock:
+            self._stats['writes'] += 1
+            if self.write_through_cold:
+                now = time.monotonic()
+                last = self._recent.get(key)
+                self._recent[key] = now
+                if last is None or now - last >= self.interval:
+                    # Запись обработчика новее всего, что могло остаться в буфере
+                    self._pending.pop(key, None)
+                    self._stats['written_through'] += 1
+                    return False
+            if key in self._pending:
+                self._stats['coalesced'] += 1
+            self._pending[key] = values
+            full = len(self._pending) >= self.max_entries
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+        return True
+
+    def _update_sql(self, batch: Dict[Any, Dict[str, Any]]) -> str:
+        names = list(self.columns)
+        rows = ', '.join(
+            '(' + ', '.join([f'{_literal(key)}::{self.key_type}'] + [f'{_literal(values.get(name))}::{self.columns[name]}' for name in names]) + ')'
+            for key, values in batch.items()
+        )
+        condition = f' AND ({self.condition})' if self.condition else ''
+        update = f"""
+            UPDATE {self.table} AS t SET {', '.join(f'{name} = v.{name}' for name in names)}
+            FROM (VALUES {rows}) AS v ({self.key}, {', '.join(names)})
+            WHERE t.{self.key} = v.{self.key}{condition}
+        """
+        if not self.notify_sql:
+            return update
+        return f"""
+            WITH updated AS ({update} RETURNING t.*),
+            notified AS (SELECT {self.notify_sql} FROM updated u)
+            SELECT (SELECT COUNT(*) FROM updated), (SELECT COUNT(*) FROM notified)
+        """
+
+    def _execute(self, cur, batch: Dict[Any, Dict[str, Any]]) -> bool:
+        try:
+            cur.execute(self._update_sql(batch))
+            cur.connection.commit()
+            return True
+        except Exception as e:
+            cur.connection.rollback()
+            with self._lock:
+                self._stats['failures'] += 1
+            if len(batch) == 1:
+                print(f'[write-behind:{self.name}] row {next(iter(batch))} failed: {e}')
+            return False
+
+    def _requeue(self, key: Any, values: Dict[str, Any]) -> None:
+        '''Строка не записалась: вернуть в буфер до MAX_ROW_ATTEMPTS раз подряд, потом выбросить'''
+        with self._lock:
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= MAX_ROW_ATTEMPTS:
+                self._attempts.pop(key, None)
+                self._stats['dropped'] += 1
+                print(f'[write-behind:{self.name}] dropped row {key} after {attempts} attempts')
+                return
+            self._attempts[key] = attempts
+            # Значения, пришедшие во время записи, новее — их не трогаем
+            self._pending.setdefault(key, values)
+
+    def flush(self, cur) -> int:
+        '''
+        Пишет всё накопленное пачками по max_entries ключей, каждая — отдельным COMMIT. Если пачка
+        не записалась, её строки пишутся по одной: плохая строка не задерживает остальные
+        '''
+        # Только то, что накоплено к началу сброса: строки, вернувшиеся в буфер, ждут следующего
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        keys = list(pending)
+        settled = 0
+        written = 0
+        try:
+            for start in range(0, len(keys), self.max_entries):
+                batch = {key: pending[key] for key in keys[start:start + self.max_entries]}
+                started = time.perf_counter()
+                if self._execute(cur, batch):
+                    done = list(batch)
+                else:
+                    done = []
+                    for key, values in batch.items():
+                        if self._execute(cur, {key: values}):
+                            done.append(key)
+                        else:
+                            self._requeue(key, values)
+                settled = start + len(batch)
+                with self._lock:
+                    for key in done:
+                        self._attempts.pop(key, None)
+                    self._stats['batches'] += 1
+                    self._stats['rows'] += len(done)
+                    self._stats['flush_ms'] += (time.perf_counter() - started) * 1000
+                written += len(done)
+                if not done:
+                    # Ничего не записалось (скорее всего, недоступна БД) — остальное ждёт следующего сброса
+                    break
+        finally:
+            # Пачки, до которых не дошло (или оборванные исключением), возвращаются в буфер без попытки
+            with self._lock:
+                for key in keys[settled:]:
+                    self._pending.setdefault(key, pending[key])
+        return written
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        from shared.db import connect
+        conn = connect()
+        try:
+            cur = conn.cursor()
+            self.flush(cur)
+            cur.close()
+        finally:
+            conn.close()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self._flush()
+            except Exception as e:
+                print(f'[write-behind:{self.name}] flush failed: {e}')
+            if self.write_through_cold:
+                threshold = time.monotonic() - self.interval
+                with self._lock:
+                    self._recent = {key: at for key, at in self._recent.items() if at > threshold}
+
+    def stop(self) -> None:
+        '''Останавливает фоновый поток и дописывает остаток в вызывающем потоке'''
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['interval_ms'] = self.interval * 1000
+        stats['flush_ms'] = round(stats['flush_ms'], 1)
+        # Доля вызовов, которые не дошли до БД отдельной строкой: значение перезаписано до записи
+        stats['coalesced_ratio'] = round(stats['coalesced'] / stats['writes'], 3) if stats['writes'] else 0
+        return stats
+
+
+def enabled() -> bool:
+    '''Принимают ли буферы записи сейчас'''
+    return _enabled
+
+
+def start_all() -> None:
+    global _enabled
+    _enabled = True
+
+
+def stop_all() -> None:
+    '''Вызывать, когда обработчиков уже нет: новые put() пишут сами, буферы дописываются'''
+    global _enabled
+    _enabled = False
+    for name, instance in list(_instances.items()):
+        try:
+            instance.stop()
+        except Exception as e:
+            print(f'[write-behind:{name}] final flush failed: {e}')
+
+
+def all_stats() -> dict:
+    return {name: instance.stats() for name, instance in _instances.items()}
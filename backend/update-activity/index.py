@@ -5,9 +5,9 @@ Returns: HTTP response with success status
 '''
 
 import json
-import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared.presence import get_presence
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
@@ -45,23 +45,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     user_id = int(user_id_str)
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
+    presence = get_presence()
     
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    
-    safe_user_id = str(user_id).replace("'", "''")
-    cur.execute(
-        f"UPDATE users SET last_activity = CURRENT_TIMESTAMP WHERE id = '{safe_user_id}'"
-    )
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Обычно пульс остаётся в памяти; соединение нужно, только чтобы разослать его другим процессам
+    if not presence.record(user_id):
+        conn = connect()
+        cur = conn.cursor()
+        presence.heartbeat(cur, user_id)
+        conn.commit()
+        cur.close()
+        conn.close()
     
     return {
         'statusCode': 200,
@@ -1,7 +1,27 @@
 import json
+import math
 import os
-import psycopg2
 from typing import Dict, Any
+from shared.db import connect
+from shared.events import FEED_EVENTS_CHANNEL, notify
+from shared.write_behind import WriteBehind
+
+# Частые обновления координат одного пользователя (чаще раза в UPDATE_LOCATION_FLUSH_MS) копятся в буфере:
+# в БД уходит только последняя точка, одним UPDATE на всех пользователей пачки
+UPDATE_LOCATION_FLUSH_MS = float(os.environ.get('UPDATE_LOCATION_FLUSH_MS', '1000'))
+UPDATE_LOCATION_FLUSH_MAX = int(os.environ.get('UPDATE_LOCATION_FLUSH_MAX', '500'))
+# users.city — VARCHAR(100) из V0031 (ADD COLUMN IF NOT EXISTS в V0032 с VARCHAR(255) её не меняет)
+MAX_CITY_LENGTH = 100
+
+location_writes = WriteBehind(
+    'update-location', 'users', 'id', {'latitude': 'numeric', 'longitude': 'numeric', 'city': 'varchar'},
+    interval_ms=UPDATE_LOCATION_FLUSH_MS, max_entries=UPDATE_LOCATION_FLUSH_MAX,
+    # Горячие окна и сетки процессов получают событие location при записи пачки
+    notify_sql=f"""pg_notify('{FEED_EVENTS_CHANNEL}', json_build_object(
+        'type', 'location', 'userId', u.id, 'latitude', u.latitude::float8, 'longitude', u.longitude::float8
+    )::text)""",
+    write_through_cold=True,
+)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -50,7 +70,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     longitude = body_data.get('longitude')
     city = body_data.get('city', '').strip()
     
-    if latitude is None or longitude is None:
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -58,14 +81,41 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    # Значение, которое не поместится в колонку, не должно попасть ни в UPDATE, ни в буфер
+    if not (math.isfinite(latitude) and math.isfinite(longitude)) or abs(latitude) > 90 or abs(longitude) > 180:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Latitude must be within [-90, 90], longitude within [-180, 180]'}),
+            'isBase64Encoded': False
+        }
+    
+    if len(city) > MAX_CITY_LENGTH:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'City must be at most {MAX_CITY_LENGTH} characters'}),
+            'isBase64Encoded': False
+        }
+    
     user_id = int(user_id_str)
+    location_event = {'type': 'location', 'userId': user_id, 'latitude': latitude, 'longitude': longitude}
+    
+    # Первый вызов за окно пишется сразу (следующий запрос клиента уже видит новые координаты), повторные — в буфер
+    if location_writes.put(user_id, {'latitude': latitude, 'longitude': longitude, 'city': city}):
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'success': True,
+                'latitude': latitude,
+                'longitude': longitude,
+                'city': city
+            }),
+            'isBase64Encoded': False
+        }
     
-    dsn = os.environ.get('TIMEWEB_DB_URL')
-    if dsn and '?' in dsn:
-        dsn += '&sslmode=require'
-    elif dsn:
-        dsn += '?sslmode=require'
-    conn = psycopg2.connect(dsn)
+    conn = connect()
     cur = conn.cursor()
     
     safe_city = city.replace("'", "''") if city else ''
@@ -78,6 +128,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             WHERE id = {user_id}
         """)
         affected = cur.rowcount
+        # Горячее окно чата фильтрует ленту по радиусу в памяти — ему нужны свежие координаты
+        notify(cur, FEED_EVENTS_CHANNEL, location_event)
         conn.commit()
         print(f'[UPDATE-LOCATION] Updated with city, rows affected: {affected}')
         cur.close()
@@ -91,7 +143,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         except:
             pass
         # Reconnect
-        conn = psycopg2.connect(dsn)
+        conn = connect()
         cur = conn.cursor()
         cur.execute(f"""
             UPDATE users 
@@ -99,6 +151,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             WHERE id = {user_id}
         """)
         affected = cur.rowcount
+        notify(cur, FEED_EVENTS_CHANNEL, location_event)
         conn.commit()
         print(f'[UPDATE-LOCATION] Updated without city, rows affected: {affected}')
         cur.close()
@@ -0,0 +1,3 @@
+-- Лента get-messages фильтруется по радиусу в SQL: авторы ищутся по idx_users_location (прямоугольник),
+-- а их последние сообщения — по индексу (user_id, created_at)
+CREATE INDEX IF NOT EXISTS idx_messages_user_created_at ON messages(user_id, created_at DESC);
@@ -0,0 +1,2 @@
+-- Keyset-пагинация get-messages: ORDER BY created_at DESC, id DESC и условие (created_at, id) < курсора
+CREATE INDEX IF NOT EXISTS idx_messages_created_at_id ON messages(created_at DESC, id DESC);
@@ -0,0 +1,2 @@
+-- Время последнего изменения реакций сообщения: get-messages?since_id=... отдаёт счётчики только изменившихся
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS reactions_updated_at TIMESTAMP;
@@ -0,0 +1,16 @@
+-- Материализованные счётчики реакций: add-reaction меняет их в той же транзакции,
+-- get-messages читает по индексу вместо COUNT(*) ... GROUP BY по message_reactions
+CREATE TABLE IF NOT EXISTS message_reaction_counts (
+    message_id INTEGER NOT NULL,
+    emoji VARCHAR(10) NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (message_id, emoji)
+);
+
+INSERT INTO message_reaction_counts (message_id, emoji, count)
+SELECT message_id, emoji, COUNT(*)
+FROM message_reactions
+WHERE message_id IS NOT NULL
+GROUP BY message_id, emoji
+ON CONFLICT (message_id, emoji) DO UPDATE SET count = EXCLUDED.count;
@@ -0,0 +1,21 @@
+-- Двойные тапы создавали дубликаты реакций: оставляем по одной и запрещаем повтор уникальным индексом,
+-- на который опирается атомарный toggle в add-reaction (INSERT ... ON CONFLICT)
+DELETE FROM message_reactions a
+USING message_reactions b
+WHERE a.message_id = b.message_id
+  AND a.user_id = b.user_id
+  AND a.emoji = b.emoji
+  AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_message_reactions_message_user_emoji
+ON message_reactions(message_id, user_id, emoji);
+
+-- Счётчики после удаления дубликатов
+UPDATE message_reaction_counts c
+SET count = s.count, updated_at = CURRENT_TIMESTAMP
+FROM (
+    SELECT message_id, emoji, COUNT(*) AS count
+    FROM message_reactions
+    GROUP BY message_id, emoji
+) s
+WHERE c.message_id = s.message_id AND c.emoji = s.emoji AND c.count <> s.count;
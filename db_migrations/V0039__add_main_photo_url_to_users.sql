@@ -0,0 +1,12 @@
+-- Денормализованная главная фотография пользователя: поддерживается profile-photos при add/delete/set_main,
+-- лента и личные сообщения берут аватарку из users без DISTINCT ON по user_photos
+ALTER TABLE users ADD COLUMN IF NOT EXISTS main_photo_url TEXT;
+
+UPDATE users u
+SET main_photo_url = p.photo_url
+FROM (
+    SELECT DISTINCT ON (user_id) user_id, photo_url
+    FROM user_photos
+    ORDER BY user_id, display_order ASC, created_at DESC
+) p
+WHERE p.user_id = u.id;
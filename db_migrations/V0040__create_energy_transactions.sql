@@ -0,0 +1,26 @@
+-- Журнал энергии только на добавление: каждая строка хранит баланс после операции,
+-- поэтому последняя строка пользователя — снимок текущего баланса, без UPDATE горячей строки users.
+-- seq — номер операции пользователя; уникальность (user_id, seq) не даёт двум параллельным
+-- операциям посчитаться от одного и того же баланса (вторая получает конфликт и повторяется)
+CREATE TABLE IF NOT EXISTS energy_transactions (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    reason VARCHAR(32) NOT NULL,
+    reference VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, seq)
+);
+
+-- Повторный webhook с тем же платежом не начисляет энергию второй раз
+CREATE UNIQUE INDEX IF NOT EXISTS uq_energy_transactions_reference
+ON energy_transactions (reason, reference)
+WHERE reference IS NOT NULL;
+
+-- users.energy дальше — стартовый баланс; у пользователей без строк в журнале баланс берётся из него
+INSERT INTO energy_transactions (user_id, seq, amount, balance, reason)
+SELECT id, 0, COALESCE(energy, 0), COALESCE(energy, 0), 'opening'
+FROM users
+ON CONFLICT (user_id, seq) DO NOTHING;
@@ -0,0 +1,4 @@
+-- Переписка двух пользователей: ключ (LEAST, GREATEST) одинаков для сообщений в обе стороны,
+-- поэтому история — один диапазон индекса в порядке (created_at, id) вместо OR по sender/receiver и сортировки
+CREATE INDEX IF NOT EXISTS idx_private_messages_pair_created_at
+ON private_messages (LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), created_at DESC, id DESC);
@@ -0,0 +1,27 @@
+-- Список диалогов: строка на каждую сторону пары пользователей с последним сообщением и счётчиком
+-- непрочитанных. Ведётся private-messages (POST и чтение), get-conversations читает диапазон индекса
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER NOT NULL,
+    other_user_id INTEGER NOT NULL,
+    last_message_id INTEGER NOT NULL,
+    last_message TEXT,
+    last_message_at TIMESTAMP NOT NULL,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, other_user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversations_user_last_message
+ON conversations (user_id, last_message_at DESC);
+
+-- Заполнение из существующей переписки
+INSERT INTO conversations (user_id, other_user_id, last_message_id, last_message, last_message_at, unread_count)
+SELECT DISTINCT ON (side.user_id, side.other_user_id)
+       side.user_id, side.other_user_id, pm.id, pm.text, pm.created_at,
+       (SELECT COUNT(*) FROM private_messages u
+        WHERE u.receiver_id = side.user_id AND u.sender_id = side.other_user_id AND u.is_read = FALSE)
+FROM private_messages pm
+CROSS JOIN LATERAL (
+    VALUES (pm.sender_id, pm.receiver_id), (pm.receiver_id, pm.sender_id)
+) AS side (user_id, other_user_id)
+ORDER BY side.user_id, side.other_user_id, pm.created_at DESC, pm.id DESC
+ON CONFLICT (user_id, other_user_id) DO NOTHING;
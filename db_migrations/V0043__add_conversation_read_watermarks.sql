@@ -0,0 +1,22 @@
+-- Водяной знак прочтения: все входящие сообщения диалога с id <= last_read_message_id прочитаны.
+-- Чтение переписки — UPDATE одной строки conversations вместо UPDATE is_read каждого сообщения;
+-- private_messages.is_read больше не обновляется
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER NOT NULL DEFAULT 0;
+
+-- Заполнение из is_read: знак стоит перед первым непрочитанным входящим, а без непрочитанных —
+-- на последнем входящем. Прочитанные после непрочитанного считаются непрочитанными
+UPDATE conversations c
+SET last_read_message_id = COALESCE(
+        (SELECT MIN(pm.id) - 1 FROM private_messages pm
+         WHERE pm.receiver_id = c.user_id AND pm.sender_id = c.other_user_id AND pm.is_read = FALSE),
+        (SELECT MAX(pm.id) FROM private_messages pm
+         WHERE pm.receiver_id = c.user_id AND pm.sender_id = c.other_user_id),
+        0
+    );
+
+-- Счётчик непрочитанных дальше выводится из знака
+UPDATE conversations c
+SET unread_count = (
+    SELECT COUNT(*) FROM private_messages pm
+    WHERE pm.receiver_id = c.user_id AND pm.sender_id = c.other_user_id AND pm.id > c.last_read_message_id
+);
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк расстояний (backend/shared/geo.py): поштучный haversine_km в цикле
+против distances_km (NumPy пачкой) и within_radius (прямоугольник + гаверсинус)
+
+Точки разбросаны по европейской части России, центр — Москва, радиус 100 км.
+
+Пример:
+    python scripts/bench_geo.py --sizes 1000 100000 --radius 100
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import numpy as np
+
+from shared.geo import distances_km, haversine_km, within_radius
+
+ORIGIN = (55.7558, 37.6173)
+
+
+def make_points(count, seed=42):
+    rng = random.Random(seed)
+    lats = [rng.uniform(43.0, 68.0) for _ in range(count)]
+    lons = [rng.uniform(27.0, 60.0) for _ in range(count)]
+    return lats, lons
+
+
+def best_ms(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+def run(size, radius, repeat):
+    lats, lons = make_points(size)
+    lats_np, lons_np = np.array(lats), np.array(lons)
+
+    def scalar():
+        return [i for i in range(size) if haversine_km(ORIGIN[0], ORIGIN[1], lats[i], lons[i]) <= radius]
+
+    def batch():
+        return np.flatnonzero(distances_km(ORIGIN[0], ORIGIN[1], lats_np, lons_np) <= radius)
+
+    def prefiltered():
+        return np.flatnonzero(within_radius(ORIGIN[0], ORIGIN[1], lats_np, lons_np, radius))
+
+    expected = scalar()
+    assert list(batch()) == expected and list(prefiltered()) == expected, "результаты расходятся"
+
+    scalar_ms = best_ms(scalar, repeat)
+    print(f"{size:>8} точек, в радиусе {len(expected)}:")
+    print(f"  haversine_km в цикле     {scalar_ms:9.3f} мс")
+    for name, fn in (("distances_km (NumPy)", batch), ("within_radius (bbox+NumPy)", prefiltered)):
+        ms = best_ms(fn, repeat)
+        print(f"  {name:<25}{ms:9.3f} мс  (x{scalar_ms / ms:.0f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--radius", type=float, default=100.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.radius, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
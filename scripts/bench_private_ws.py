@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк WebSocket-канала личных сообщений (/ws/private в server.py)
+
+Открывает N соединений к одному процессу uvicorn, отправляет сообщения через
+private-messages POST и меряет, за сколько каждое доходит до всех сокетов.
+
+Пример:
+    python scripts/bench_private_ws.py --base http://127.0.0.1:8000 \\
+        --connections 2000 --sender 8 --receiver 7 --messages 20 --pid 12345
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+
+import websockets
+
+
+def rss_mb(pid):
+    """RSS процесса сервера в МБ (Linux /proc)"""
+    if not pid:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def send_private_message(base, sender, receiver, text):
+    request = urllib.request.Request(
+        f"{base}/private-messages",
+        data=json.dumps({"receiverId": receiver, "text": text}).encode(),
+        headers={"Content-Type": "application/json", "X-User-Id": str(sender)},
+        method="POST",
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())["messageId"]
+
+
+async def open_sockets(ws_url, count, batch=200):
+    sockets = []
+    started = time.perf_counter()
+    for i in range(0, count, batch):
+        chunk = await asyncio.gather(*[
+            websockets.connect(ws_url, max_queue=None, ping_interval=None)
+            for _ in range(min(batch, count - i))
+        ])
+        sockets.extend(chunk)
+    return sockets, time.perf_counter() - started
+
+
+async def wait_for_message(ws, message_id, sent_at):
+    while True:
+        event = json.loads(await ws.recv())
+        if event.get("type") == "message" and event["message"]["id"] == message_id:
+            return time.perf_counter() - sent_at
+
+
+async def run(args):
+    ws_url = args.base.replace("http", "ws", 1) + f"/ws/private?userId={args.receiver}"
+    rss_before = rss_mb(args.pid)
+
+    print(f"Открываем {args.connections} соединений...")
+    sockets, connect_time = await open_sockets(ws_url, args.connections)
+    rss_after = rss_mb(args.pid)
+    print(f"  открыто за {connect_time:.2f}с ({args.connections / connect_time:.0f} conn/s)")
+    if rss_before is not None:
+        per_conn_kb = (rss_after - rss_before) * 1024 / args.connections
+        print(f"  RSS сервера: {rss_before:.1f} → {rss_after:.1f} МБ (~{per_conn_kb:.1f} КБ на соединение)")
+
+    loop = asyncio.get_running_loop()
+    fanout = []
+    for i in range(args.messages):
+        sent_at = time.perf_counter()
+        message_id = await loop.run_in_executor(
+            None, send_private_message, args.base, args.sender, args.receiver, f"bench {i}"
+        )
+        latencies = await asyncio.gather(*[wait_for_message(ws, message_id, sent_at) for ws in sockets])
+        fanout.append(latencies)
+
+    p50 = [statistics.median(l) * 1000 for l in fanout]
+    worst = [max(l) * 1000 for l in fanout]
+    print(f"Доставка {args.messages} сообщений на {args.connections} сокетов:")
+    print(f"  медиана до сокета: {statistics.median(p50):.1f} мс")
+    print(f"  до последнего сокета: p50 {statistics.median(worst):.1f} мс, max {max(worst):.1f} мс")
+
+    await asyncio.gather(*[ws.close() for ws in sockets])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--sender", type=int, required=True)
+    parser.add_argument("--receiver", type=int, required=True)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--pid", type=int, help="PID процесса uvicorn для замера памяти")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
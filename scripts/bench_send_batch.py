@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк group commit в send-message (SEND_MESSAGE_BATCH_MS): пропускная способность
+против добавленной задержки при разных окнах пачки
+
+N потоков вызывают handler() напрямую, как пул потоков server.py, каждый отправляет
+сообщения подряд. Окно 0 — обычный режим, запрос и COMMIT на каждое сообщение.
+Перед каждым прогоном отправителям начисляется энергия на все сообщения (reason 'admin').
+
+Пример:
+    TIMEWEB_DB_URL=postgresql://... python scripts/bench_send_batch.py \\
+        --users 7 8 --threads 32 --messages 20 --windows 0 1 2 5 10
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+from shared import energy
+from shared.db import connect
+
+
+def load_send_message(window_ms, max_batch):
+    """Свежий экземпляр модуля: окно читается из окружения при импорте"""
+    os.environ["SEND_MESSAGE_BATCH_MS"] = str(window_ms)
+    os.environ["SEND_MESSAGE_BATCH_MAX"] = str(max_batch)
+    spec = importlib.util.spec_from_file_location(
+        f"send_message_{window_ms}", os.path.join(BACKEND_DIR, "send-message", "index.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def top_up(users, amount):
+    conn = connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+    for user_id in users:
+        energy.apply(cur, user_id, amount, "admin")
+    cur.close()
+    conn.close()
+
+
+def run(module, users, threads, messages):
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(n):
+        user_id = users[n % len(users)]
+        for i in range(messages):
+            event = {
+                "httpMethod": "POST",
+                "headers": {},
+                "body": json.dumps({"user_id": user_id, "text": f"bench {n}/{i}"}),
+            }
+            started = time.perf_counter()
+            response = module.handler(event, None)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if response["statusCode"] != 200:
+                    failures.append(response["statusCode"])
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started, latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", required=True)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--messages", type=int, default=20, help="сообщений на поток")
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 1, 2, 5, 10])
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+
+    total = args.threads * args.messages
+    print(f"{args.threads} потоков x {args.messages} сообщений, отправители {args.users}")
+    print(f"{'окно, мс':>9} {'сообщ/с':>9} {'p50, мс':>9} {'p99, мс':>9} {'пачка':>7} {'ошибки':>7}")
+    for window in args.windows:
+        top_up(args.users, energy.MESSAGE_COST * total)
+        module = load_send_message(window, args.max_batch)
+        elapsed, latencies, failures = run(module, args.users, args.threads, args.messages)
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        batch = module.batcher.stats()["avg_batch"] if module.batcher else 1
+        print(f"{window:>9g} {total / elapsed:>9.0f} {statistics.median(latencies):>9.2f} "
+              f"{p99:>9.2f} {batch:>7} {len(failures):>7}")
+
+
+if __name__ == "__main__":
+    main()
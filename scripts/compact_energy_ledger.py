@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Сжатие журнала energy_transactions: удаляет старые списания за сообщения
+
+Баланс хранится в каждой строке журнала, поэтому старые строки для него не нужны —
+последняя строка пользователя остаётся снимком. Начисления, платежи и операции админа не трогаются.
+Каждая пачка — отдельная транзакция.
+
+Пример:
+    TIMEWEB_DB_URL=postgresql://... python scripts/compact_energy_ledger.py --days 90 --batch 10000
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from shared import energy  # noqa: E402
+from shared.db import connect  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=90, help="списания старше стольких дней удаляются")
+    parser.add_argument("--batch", type=int, default=10000, help="сколько строк удалять в одной транзакции")
+    args = parser.parse_args()
+
+    conn = connect()
+    cur = conn.cursor()
+
+    total_deleted = 0
+    while True:
+        deleted = energy.compact(cur, args.days, args.batch)
+        conn.commit()
+        total_deleted += deleted
+        if deleted < args.batch:
+            break
+        print(f"удалено {total_deleted}...")
+
+    cur.close()
+    conn.close()
+    print(f"✅ Готово, удалено строк: {total_deleted}")
+
+
+if __name__ == "__main__":
+    main()
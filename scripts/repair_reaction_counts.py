@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Сверка и починка счётчиков message_reaction_counts с таблицей message_reactions
+
+Идёт по сообщениям пачками по id, каждая пачка — отдельная транзакция,
+чтобы SHARE-блокировка message_reactions держалась недолго.
+
+Пример:
+    TIMEWEB_DB_URL=postgresql://... python scripts/repair_reaction_counts.py --batch 5000
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from shared import reactions  # noqa: E402
+from shared.db import connect  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=5000, help="сколько id сообщений в одной транзакции")
+    args = parser.parse_args()
+
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+    max_id = cur.fetchone()[0]
+    conn.commit()
+
+    total_fixed = 0
+    for start in range(0, max_id + 1, args.batch):
+        fixed = reactions.repair(cur, range(start, start + args.batch))
+        conn.commit()
+        total_fixed += fixed
+        if fixed:
+            print(f"id {start}..{start + args.batch - 1}: исправлено {fixed}")
+
+    cur.close()
+    conn.close()
+    print(f"✅ Готово, исправлено строк: {total_fixed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+from fastapi import FastAPI, Request, Response, WebSocket
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+from pathlib import Path
+
+app = FastAPI()
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+backend_dir = Path(os.environ.get("BACKEND_DIR", "/app/backend"))
+functions = {}
+
+# Общий код функций (backend/shared) импортируется как пакет shared
+sys.path.insert(0, str(backend_dir))
+
+for func_dir in backend_dir.iterdir():
+    if func_dir.is_dir() and (func_dir / "index.py").exists():
+        func_name = func_dir.name
+        try:
+            spec = importlib.util.spec_from_file_location(func_name, func_dir / "index.py")
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            functions[func_name] = module.handler
+            print(f"✅ Loaded: {func_name}")
+        except Exception as e:
+            print(f"❌ Failed to load {func_name}: {e}")
+
+# Лимиты выполнения функций: backend/func_limits.json рядом с func2url.json
+limits_path = backend_dir / "func_limits.json"
+limits = json.loads(limits_path.read_text()) if limits_path.exists() else {}
+default_limits = {"concurrency": 8, "queue": 32, **limits.get("_default", {})}
+
+# Синхронные handler() выполняются в пулах потоков своих Bulkhead, а не в event loop uvicorn;
+# этот общий пул — только для служебных запросов сервера (позиция пользователя, чёрный список)
+executor = ThreadPoolExecutor(
+    max_workers=int(limits.get("_executor", {}).get("max_workers", 32)),
+    thread_name_prefix="server",
+)
+
+
+class Bulkhead:
+    """
+    Ограничивает число одновременных вызовов одной функции и длину очереди к ней. У каждой функции
+    свой пул из concurrency потоков: медленная функция не занимает потоки, зарезервированные за другими
+    """
+
+    def __init__(self, name: str, concurrency: int, queue: int):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix=f"handler-{name}")
+        self.queued = 0
+        self.active = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def is_full(self) -> bool:
+        return self.active + self.queued >= self.concurrency + self.queue
+
+    async def run(self, fn, *args):
+        self.queued += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.active += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue": self.queue,
+            "queued": self.queued,
+            "active": self.active,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+bulkheads = {
+    name: Bulkhead(name, **{**default_limits, **limits.get(name, {})})
+    for name in functions
+}
+
+class Subscription:
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+
+class Hub:
+    """In-process pub/sub: события из потока pg-listener раздаются подписчикам в event loop"""
+
+    def __init__(self):
+        self.loop = None
+        self.subscribers = {}
+
+    def subscribe(self, channel: str, maxsize: int = 100) -> Subscription:
+        subscription = Subscription(maxsize)
+        self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, channel: str, subscription: Subscription):
+        subscribers = self.subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[channel]
+
+    def publish_threadsafe(self, channel: str, payload):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.publish, channel, payload)
+
+    def publish(self, channel: str, payload):
+        for subscription in list(self.subscribers.get(channel, ())):
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # Медленный клиент: закрываем поток, он переподключится с Last-Event-ID и догонит из БД
+                subscription.overflowed = True
+                subscription.queue.get_nowait()
+                subscription.queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        # Каналы вида user:<id> суммируются, чтобы не выводить по строке на пользователя
+        counts = {}
+        for channel, subs in self.subscribers.items():
+            key = channel.split(":", 1)[0]
+            counts[key] = counts.get(key, 0) + len(subs)
+        return counts
+
+
+def on_notification(channel: str, payload):
+    """Callback pg-listener: адресные события раскладываются по каналам user:<id>, события ленты — в горячее окно"""
+    from shared.blocklist import get_blocklist
+    from shared.events import (
+        BLOCKLIST_CHANNEL, CHAT_MESSAGES_CHANNEL, FEED_EVENTS_CHANNEL, PRESENCE_CHANNEL, PRIVATE_EVENTS_CHANNEL,
+    )
+    from shared.hot_window import get_window
+    from shared.nearby import get_grid
+    from shared.presence import get_presence
+    if channel == PRIVATE_EVENTS_CHANNEL:
+        for delivery in payload.get("deliveries", []):
+            for user_id in delivery.get("userIds", []):
+                hub.publish_threadsafe(f"user:{user_id}", delivery["event"])
+    elif channel == FEED_EVENTS_CHANNEL:
+        get_window().apply(payload)
+        get_grid().apply(payload)
+    elif channel == BLOCKLIST_CHANNEL:
+        get_blocklist().apply(payload)
+    elif channel == PRESENCE_CHANNEL:
+        get_presence().apply(payload)
+    else:
+        if channel == CHAT_MESSAGES_CHANNEL:
+            get_window().add_message(payload)
+        hub.publish_threadsafe(channel, payload)
+
+
+def load_caches():
+    """Вызывается pg-listener после (пере)подключения: пока его не было, события ленты могли потеряться"""
+    from shared.blocklist import get_blocklist
+    from shared.db import connect
+    from shared.hot_window import get_window
+    from shared.nearby import get_grid
+    from shared.presence import get_presence
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        get_window().load(cur)
+        get_grid().load(cur)
+        get_presence().load(cur)
+        cur.close()
+    finally:
+        conn.close()
+    get_blocklist().reset()
+
+
+hub = Hub()
+listener = None
+
+class Context:
+    def __init__(self, request_id, function_name):
+        self.request_id = request_id
+        self.function_name = function_name
+        self.function_version = "1"
+        self.memory_limit_in_mb = 256
+
+@app.get("/_stats")
+async def stats():
+    from shared.blocklist import get_blocklist
+    from shared.db import get_pool
+    from shared.group_commit import all_stats
+    from shared.hot_window import get_window
+    from shared.nearby import get_grid
+    from shared.presence import get_presence
+    from shared.write_behind import all_stats as write_behind_stats
+    return {
+        "functions": {name: bulkhead.stats() for name, bulkhead in bulkheads.items()},
+        "db_pool": get_pool().stats(),
+        "streams": hub.stats(),
+        "hot_window": get_window().stats(),
+        "nearby_grid": get_grid().stats(),
+        "group_commit": all_stats(),
+        "blocklist": get_blocklist().stats(),
+        "presence": get_presence().stats(),
+        "write_behind": write_behind_stats(),
+    }
+
+def load_user_location(user_id: int):
+    from shared.db import connect
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT latitude, longitude FROM users WHERE id = {int(user_id)}")
+        row = cur.fetchone()
+        cur.close()
+        return row if row and row[0] and row[1] else None
+    finally:
+        conn.close()
+
+def load_blocked(user_id: int):
+    from shared.blocklist import get_blocklist
+    from shared.db import connect
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        blocked = get_blocklist().related(cur, user_id)
+        cur.close()
+        return blocked
+    finally:
+        conn.close()
+
+def sse_event(event_id, event: str, data) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/stream/messages")
+async def stream_messages(request: Request):
+    """
+    SSE-поток новых сообщений общего чата в формате get-messages (вместо поллинга).
+    Параметры: userId (EventSource не умеет заголовки) или X-User-Id, radius, lastEventId или Last-Event-ID
+    """
+    from shared.blocklist import get_blocklist
+    from shared.events import CHAT_MESSAGES_CHANNEL
+    from shared.geo import haversine_km
+
+    params = request.query_params
+    user_id = request.headers.get("x-user-id") or params.get("userId")
+    last_event_id = request.headers.get("last-event-id") or params.get("lastEventId")
+    try:
+        radius = float(params.get("radius", 100))
+        user_id = int(user_id) if user_id else None
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return Response(content='{"error":"Invalid userId, radius or lastEventId"}', status_code=400, media_type="application/json")
+
+    loop = asyncio.get_running_loop()
+    origin = None
+    if user_id and radius < 99999:
+        origin = await loop.run_in_executor(executor, load_user_location, user_id)
+
+    # Подписываемся до догрузки пропущенного, чтобы не потерять сообщения между ними
+    subscription = hub.subscribe(CHAT_MESSAGES_CHANNEL)
+    replay = []
+    if last_event_id is not None and "get-messages" in functions:
+        event = {
+            "httpMethod": "GET",
+            "headers": {"X-User-Id": str(user_id)} if user_id else {},
+            "queryStringParameters": {"since_id": str(last_event_id), "radius": str(radius), "limit": "100"},
+            "body": "",
+        }
+        try:
+            result = await bulkheads["get-messages"].run(functions["get-messages"], event, Context("sse-replay", "get-messages"))
+            replay = json.loads(result.get("body") or "{}").get("messages", [])
+        except Exception as e:
+            print(f"⚠️ SSE replay failed: {e}")
+
+    async def events():
+        try:
+            sent_ids = set()
+            for message in replay:
+                sent_ids.add(message["id"])
+                yield sse_event(message["id"], "message", message)
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(subscription.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if payload is None:
+                    break
+                message = payload["message"]
+                if message["id"] in sent_ids:
+                    continue
+                if origin and haversine_km(origin[0], origin[1], payload["latitude"], payload["longitude"]) > radius:
+                    continue
+                if user_id:
+                    blocked = get_blocklist().peek(user_id)
+                    if blocked is None:
+                        blocked = await loop.run_in_executor(executor, load_blocked, user_id)
+                    if message["user"]["id"] in blocked:
+                        continue
+                yield sse_event(message["id"], "message", message)
+        finally:
+            hub.unsubscribe(CHAT_MESSAGES_CHANNEL, subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Access-Control-Allow-Origin": "*"},
+    )
+
+@app.websocket("/ws/private")
+async def private_socket(websocket: WebSocket):
+    """
+    WebSocket личных сообщений: новые сообщения, прочтения (read) и счётчики непрочитанных (unread).
+    Пользователь — userId в query (браузер не ставит заголовки на WebSocket) или X-User-Id
+    """
+    try:
+        user_id = int(websocket.headers.get("x-user-id") or websocket.query_params.get("userId"))
+    except (TypeError, ValueError):
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    channel = f"user:{user_id}"
+    subscription = hub.subscribe(channel)
+
+    async def pump():
+        while True:
+            event = await subscription.queue.get()
+            if event is None:
+                # Клиент не успевает читать: пусть переподключится и догрузит историю через GET
+                await websocket.close(code=1013)
+                return
+            await websocket.send_json(event)
+
+    async def drain():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(drain())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        hub.unsubscribe(channel, subscription)
+
+@app.api_route("/{function_name:path}", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+async def proxy(function_name: str, request: Request):
+    parts = function_name.split('/', 1)
+    func_name = parts[0]
+    path = '/' + parts[1] if len(parts) > 1 else '/'
+
+    if func_name not in functions:
+        return Response(content='{"error":"Function not found"}', status_code=404, media_type="application/json")
+
+    body = await request.body()
+    event = {
+        "httpMethod": request.method,
+        "headers": dict(request.headers),
+        "queryStringParameters": dict(request.query_params),
+        "body": body.decode('utf-8') if body else "",
+        "pathParams": {"path": path},
+        "requestContext": {
+            "requestId": request.headers.get("x-request-id", "local"),
+            "identity": {
+                "sourceIp": request.client.host if request.client else "127.0.0.1",
+                "userAgent": request.headers.get("user-agent", "")
+            },
+            "httpMethod": request.method,
+            "requestTime": "",
+            "requestTimeEpoch": 0
+        },
+        "isBase64Encoded": False
+    }
+
+    context = Context(event["requestContext"]["requestId"], func_name)
+
+    bulkhead = bulkheads[func_name]
+    if bulkhead.is_full():
+        bulkhead.rejected += 1
+        return Response(
+            content='{"error":"Service busy, retry later"}',
+            status_code=503,
+            headers={"Retry-After": "1", "Access-Control-Allow-Origin": "*"},
+            media_type="application/json"
+        )
+
+    try:
+        result = await bulkhead.run(functions[func_name], event, context)
+        return Response(
+            content=result.get("body", ""),
+            status_code=result.get("statusCode", 200),
+            headers=dict(result.get("headers", {})),
+            media_type=result.get("headers", {}).get("Content-Type", "application/json")
+        )
+    except Exception as e:
+        return Response(content=f'{{"error":"{str(e)}"}}', status_code=500, media_type="application/json")
+
+@app.on_event("startup")
+def warmup_db_pool():
+    from shared.db import get_pool
+    try:
+        get_pool().warmup()
+    except Exception as e:
+        print(f"⚠️ DB pool warmup failed: {e}")
+
+@app.on_event("startup")
+async def start_listener():
+    global listener
+    from shared.db import get_dsn
+    from shared.events import (
+        BLOCKLIST_CHANNEL, CHAT_MESSAGES_CHANNEL, FEED_EVENTS_CHANNEL, PRESENCE_CHANNEL, PRIVATE_EVENTS_CHANNEL,
+        Listener,
+    )
+    from shared.write_behind import start_all
+    hub.loop = asyncio.get_running_loop()
+    if get_dsn():
+        listener = Listener(
+            [CHAT_MESSAGES_CHANNEL, PRIVATE_EVENTS_CHANNEL, FEED_EVENTS_CHANNEL, BLOCKLIST_CHANNEL, PRESENCE_CHANNEL],
+            on_notification,
+        )
+        listener.on_connect = load_caches
+        listener.start()
+        start_all()
+
+@app.on_event("shutdown")
+def close_db_pool():
+    from shared.db import get_pool
+    from shared.write_behind import stop_all
+    if listener is not None:
+        listener.stop()
+    for bulkhead in bulkheads.values():
+        bulkhead.executor.shutdown(wait=True)
+    executor.shutdown(wait=True)
+    # После обработчиков: отложенные записи последних вызовов тоже должны попасть в БД
+    stop_all()
+    get_pool().close_all()
+
+@app.get("/")
+async def root():
+    return {"status": "ok", "functions": list(functions.keys())}